@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Async PostgreSQL access for the GraphQL API
+An asyncpg pool owned by the API's event loop, so resolvers await their
+queries instead of blocking the loop on psycopg2 calls.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+ASYNC_DB_POOL_MIN = int(os.getenv("ASYNC_DB_POOL_MIN", 1))
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", 10))
+ASYNC_DB_COMMAND_TIMEOUT = float(os.getenv("ASYNC_DB_COMMAND_TIMEOUT", 30))
+
+_pool = None
+_pool_loop = None
+_pool_lock = None
+
+_metrics = {
+    "queries": 0,
+    "errors": 0,
+    "total_query_time": 0.0,
+    "max_query_time": 0.0,
+}
+
+
+async def get_pool():
+    """The asyncpg pool for the running event loop, created on first use"""
+    global _pool, _pool_loop, _pool_lock
+    loop = asyncio.get_running_loop()
+    if _pool is not None and _pool_loop is loop:
+        return _pool
+
+    if _pool_lock is None or _pool_loop is not loop:
+        _pool_lock = asyncio.Lock()
+        _pool_loop = loop
+        _pool = None
+
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=ASYNC_DB_POOL_MIN,
+                max_size=ASYNC_DB_POOL_MAX,
+                command_timeout=ASYNC_DB_COMMAND_TIMEOUT,
+            )
+            logger.info(f"🏊 Async database pool ready ({ASYNC_DB_POOL_MIN}-{ASYNC_DB_POOL_MAX} connections)")
+    return _pool
+
+
+def _record(started, failed=False):
+    elapsed = time.perf_counter() - started
+    _metrics["queries"] += 1
+    _metrics["errors"] += failed
+    _metrics["total_query_time"] += elapsed
+    _metrics["max_query_time"] = max(_metrics["max_query_time"], elapsed)
+
+
+async def fetch(query, *args):
+    """Rows of a query as dicts"""
+    pool = await get_pool()
+    started = time.perf_counter()
+    try:
+        rows = await pool.fetch(query, *args)
+    except Exception:
+        _record(started, failed=True)
+        raise
+    _record(started)
+    return [dict(row) for row in rows]
+
+
+async def fetchrow(query, *args):
+    """First row of a query as a dict, or None"""
+    rows = await fetch(query, *args)
+    return rows[0] if rows else None
+
+
+def pool_stats():
+    """Pool size and query timing metrics"""
+    stats = dict(_metrics)
+    stats["avg_query_time"] = stats["total_query_time"] / stats["queries"] if stats["queries"] else 0.0
+    if _pool is not None:
+        stats["size"] = _pool.get_size()
+        stats["idle"] = _pool.get_idle_size()
+    else:
+        stats["size"] = stats["idle"] = 0
+    stats["max_size"] = ASYNC_DB_POOL_MAX
+    return stats
+
+
+async def listen(channel, callback, on_lost=None):
+    """Dedicated connection LISTENing on `channel`; callback(payload) runs on the loop
+
+    `on_lost()` is called if the connection drops. Returns the connection so
+    the caller can close it.
+    """
+    conn = await asyncpg.connect(DATABASE_URL)
+    await conn.add_listener(channel, lambda _conn, _pid, _channel, payload: callback(payload))
+    if on_lost:
+        conn.add_termination_listener(lambda _conn: on_lost())
+    logger.info(f"👂 Listening for {channel} notifications")
+    return conn
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Background jobs for the GraphQL API
+Fetch and upload requests become jobs that a small asyncio worker pool
+runs, so mutations return a job id immediately. Each job keeps its state,
+progress, timing and a tail of its output for polling or subscriptions.
+"""
+
+import os
+import uuid
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from datetime import datetime
+import job_runner
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", 2))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", 100))
+JOB_OUTPUT_TAIL = int(os.getenv("JOB_OUTPUT_TAIL", 50))
+FETCH_JOB_TIMEOUT = float(os.getenv("FETCH_JOB_TIMEOUT", 600))
+UPLOAD_JOB_TIMEOUT = float(os.getenv("UPLOAD_JOB_TIMEOUT", 900))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class Job:
+    """State of one background job; mutated only on the event loop"""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.state = QUEUED
+        self.progress = "Waiting for a worker"
+        self.message = ""
+        self.exit_code = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.output = deque(maxlen=JOB_OUTPUT_TAIL)
+        self._changed = asyncio.Event()
+
+    @property
+    def active(self):
+        return self.state in (QUEUED, RUNNING)
+
+    @property
+    def duration(self):
+        if not self.started_at:
+            return None
+        return ((self.finished_at or datetime.now()) - self.started_at).total_seconds()
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self._notify()
+
+    def append_output(self, line):
+        line = line.rstrip()
+        if line:
+            self.output.append(line)
+            self.progress = line[:200]
+            self._notify()
+
+    def _notify(self):
+        # Wake current subscribers and give later ones a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout=None):
+        """Wait until the job changes; returns False on timeout"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class JobManager:
+    """Registry plus asyncio worker pool; one active job per kind"""
+
+    def __init__(self, concurrency=JOB_CONCURRENCY, history=JOB_HISTORY):
+        self.concurrency = max(1, concurrency)
+        self.history = history
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._workers = []
+        self._loop = None
+        self.on_finish = []
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._workers = [loop.create_task(self._worker(i)) for i in range(self.concurrency)]
+        logger.info(f"🧵 Job pool started with {self.concurrency} workers")
+
+    def submit(self, kind):
+        """Queue a job (or return the queued/running one of the same kind); must run on the loop"""
+        self._ensure_workers()
+        for job in reversed(self.jobs.values()):
+            if job.kind == kind and job.active:
+                logger.info(f"♻️ {kind} job {job.id} already {job.state}, not starting another")
+                return job
+
+        job = Job(kind)
+        self.jobs[job.id] = job
+        self._trim()
+        self._queue.put_nowait(job)
+        logger.info(f"📥 {kind} job {job.id} queued")
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def recent(self, limit=20):
+        return list(reversed(self.jobs.values()))[:limit]
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    async def _worker(self, index):
+        while True:
+            job = await self._queue.get()
+            job.update(state=RUNNING, started_at=datetime.now(), progress="Started")
+            try:
+                runner = RUNNERS[job.kind]
+                success, message = await runner(job)
+            except Exception as e:
+                success, message = False, f"Error: {e}"
+            job.update(state=SUCCEEDED if success else FAILED, message=message,
+                       finished_at=datetime.now(), progress="Done" if success else "Failed")
+            logger.info(f"🏁 {job.kind} job {job.id} {job.state} in {job.duration:.0f}s: {message}")
+            for callback in self.on_finish:
+                callback(job)
+            self._queue.task_done()
+
+
+class _JobLogHandler(logging.Handler):
+    """Copies log lines into a job while `active()` says the work it follows is running"""
+
+    def __init__(self, job, active, loop):
+        super().__init__(level=logging.INFO)
+        self.job = job
+        self.active = active
+        self.loop = loop
+
+    def emit(self, record):
+        if not self.active():
+            return
+        self.loop.call_soon_threadsafe(self.job.append_output, self.format(record))
+
+
+async def _follow(job, active, logger_names, wait, timeout):
+    """Run the blocking `wait(timeout)` in a thread while copying `logger_names` output into the job"""
+    handler = _JobLogHandler(job, active, asyncio.get_running_loop())
+    handler.setFormatter(logging.Formatter("%(name)s: %(message)s"))
+    watched = [logging.getLogger(name) for name in logger_names]
+    for log in watched:
+        log.addHandler(handler)
+    try:
+        return await asyncio.to_thread(wait, timeout)
+    finally:
+        for log in watched:
+            log.removeHandler(handler)
+
+
+async def run_fetch(job):
+    """Trigger the scheduler's fetch job and follow it
+
+    Going through the scheduler's job runner keeps one overlap guard for
+    scheduled and API fetches: a request during a running fetch follows
+    that run instead of starting a second one against the same quotas.
+    """
+    runner = job_runner.get_runner()
+    if "fetch" not in runner.jobs:
+        return False, "No fetch job registered; the API must run inside scheduler_main.py"
+
+    started = runner.trigger("fetch", jitter=False)
+    job.update(progress="Fetch started" if started else "Following the fetch already running")
+    fetch = runner.jobs["fetch"]
+    run = await _follow(job, lambda: fetch.running, ("cloud_meme_fetcher",),
+                        lambda timeout: runner.wait("fetch", timeout), FETCH_JOB_TIMEOUT)
+    if run is None:
+        return False, f"Fetch still running after {FETCH_JOB_TIMEOUT:.0f}s"
+    return run["success"], run["message"]
+
+
+async def run_upload(job):
+    """Trigger the scheduler's upload job and follow it
+
+    Like run_fetch: API uploads share the runner's overlap guard and
+    history, and their finish updates the dashboard. The runner's thread
+    imports the uploader, so selenium never loads on the event loop.
+    """
+    runner = job_runner.get_runner()
+    if "upload" not in runner.jobs:
+        return False, "No upload job registered; the API must run inside scheduler_main.py"
+
+    started = runner.trigger("upload", jitter=False)
+    job.update(progress="Upload started" if started else "Following the upload already running")
+    upload = runner.jobs["upload"]
+    run = await _follow(job, lambda: upload.running,
+                        ("cloud_instagram_uploader", "uploader_worker", "pacing"),
+                        lambda timeout: runner.wait("upload", timeout), UPLOAD_JOB_TIMEOUT)
+    if run is None:
+        return False, f"Upload still running after {UPLOAD_JOB_TIMEOUT:.0f}s"
+    return run["success"], run["message"]
+
+
+RUNNERS = {
+    "fetch": run_fetch,
+    "upload": run_upload,
+}
+
+_manager = None
+
+
+def get_manager():
+    """Process-wide job manager for the API"""
+    global _manager
+    if _manager is None:
+        _manager = JobManager()
+    return _manager
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+GraphQL API concurrency benchmark
+Fires a query at the API from increasing numbers of concurrent clients and
+reports throughput and latency per level, so API changes can be compared
+before and after on the same database.
+"""
+
+import os
+import sys
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+# GraphQL is served by the scheduler's single server on PORT
+GRAPHQL_URL = os.getenv("GRAPHQL_URL", f"http://localhost:{os.getenv('PORT', '10000')}/graphql")
+BENCH_LEVELS = [int(n) for n in os.getenv("BENCH_LEVELS", "1,5,10,25,50").split(",")]
+BENCH_REQUESTS_PER_CLIENT = int(os.getenv("BENCH_REQUESTS_PER_CLIENT", 20))
+BENCH_QUERY = os.getenv(
+    "BENCH_QUERY",
+    "{ availableMemes(first: 20) { memes { id title score } endCursor } stats { totalAvailable totalUploaded } }"
+)
+
+
+def run_client(count):
+    """One client sending `count` sequential requests; returns latencies in seconds"""
+    latencies = []
+    errors = 0
+    with requests.Session() as session:
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                response = session.post(GRAPHQL_URL, json={"query": BENCH_QUERY}, timeout=60)
+                if response.status_code != 200 or response.json().get("errors"):
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+
+def run_level(clients, per_client=BENCH_REQUESTS_PER_CLIENT):
+    """Run `clients` concurrent clients; returns a result dict"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(run_client, [per_client] * clients))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(l for lats, _ in results for l in lats)
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+def main(levels=BENCH_LEVELS):
+    print(f"📈 Benchmarking {GRAPHQL_URL}")
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for clients in levels:
+        r = run_level(clients)
+        print(f"{r['clients']:>8} {r['requests']:>9} {r['errors']:>7} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['max_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    levels = [int(n) for n in sys.argv[1].split(",")] if len(sys.argv) > 1 else BENCH_LEVELS
+    main(levels)
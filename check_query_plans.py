@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Query plan regression check for the meme queues
+Builds the schema from migrate_db.py's migrations in a throwaway schema,
+seeds a large memes table, runs EXPLAIN on the uploader, fetcher and GraphQL queue
+queries and fails if any of them stops using its partial index.
+Everything runs inside one transaction that is rolled back at the end.
+"""
+
+import os
+import sys
+import json
+import logging
+import psycopg2
+from migrate_db import MIGRATIONS
+from cloud_instagram_uploader import CLAIM_MEMES_SQL
+from cloud_meme_fetcher import NEXT_MEME_CLAIM_SQL, UNHASHED_IMAGES_SQL
+from meme_graphql import memes_query
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+PLAN_CHECK_ROWS = int(os.getenv("PLAN_CHECK_ROWS", 200000))
+PLAN_CHECK_SCHEMA = "plan_check"
+
+# A mature table: most memes already posted and hashed, a small live queue
+SEED_ROWS_SQL = """
+    INSERT INTO memes (post_id, title, url, file_type, file_size, subreddit, score,
+                       downloaded_at, posted, failed_attempts, phash,
+                       uploaded_to_instagram, uploaded_at)
+    SELECT 'seed_' || g,
+           'Seeded meme number ' || g,
+           'https://i.redd.it/' || md5(g::text) || '.jpg',
+           CASE WHEN g %% 5 = 0 THEN 'video' ELSE 'image' END,
+           (random() * 5000000)::int,
+           'dankmemes',
+           (random() * 50000)::int,
+           NOW() - (g || ' seconds')::interval,
+           g %% 50 <> 0,
+           CASE WHEN g %% 97 = 0 THEN 3 ELSE 0 END,
+           CASE WHEN g %% 200 = 0 THEN NULL ELSE (random() * 9e18)::bigint END,
+           g %% 50 <> 0,
+           CASE WHEN g %% 50 <> 0 THEN NOW() - (g || ' minutes')::interval END
+    FROM generate_series(1, %s) AS g;
+"""
+
+# (label, SQL, parameters, index the plan must use)
+CHECKS = [
+    ("uploader claim", CLAIM_MEMES_SQL, [[1, 2, 3], 10, "plan-check", 900],
+     "idx_memes_upload_queue"),
+    ("fetcher claim (images)", NEXT_MEME_CLAIM_SQL.format(type_filter="AND file_type = %s"),
+     ["image", "plan-check", 900], "idx_memes_post_queue"),
+    ("fetcher claim (videos)", NEXT_MEME_CLAIM_SQL.format(type_filter="AND file_type = %s"),
+     ["video", "plan-check", 900], "idx_memes_post_queue"),
+    ("fetcher claim (any type)", NEXT_MEME_CLAIM_SQL.format(type_filter=""),
+     ["plan-check", 900], "idx_memes_post_queue_any"),
+    ("phash backfill", UNHASHED_IMAGES_SQL, [0, 200], "idx_memes_unhashed_images"),
+    ("graphql available", memes_query(uploaded_only=False), [21], "idx_memes_upload_queue"),
+    ("graphql available (page 2)", memes_query(uploaded_only=False, after=True), [21, 25000, 100000],
+     "idx_memes_upload_queue"),
+    ("graphql uploaded", memes_query(uploaded_only=True), [21], "idx_memes_uploaded_feed"),
+    ("graphql uploaded (page 2)", memes_query(uploaded_only=True, after=True), [21, 25000, 100000],
+     "idx_memes_uploaded_feed"),
+]
+
+
+def plan_nodes(node):
+    """Every node of an EXPLAIN (FORMAT JSON) plan tree"""
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def check_plan(cursor, label, sql, params, expected_index):
+    """EXPLAIN one query; returns True when it reads `expected_index` without a sort or seq scan on memes"""
+    if "$1" in sql:
+        # asyncpg-style placeholders (meme_graphql): explain a prepared statement
+        cursor.execute("PREPARE plan_check_stmt AS " + sql)
+        placeholders = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXPLAIN (FORMAT JSON) EXECUTE plan_check_stmt ({placeholders})", params)
+        plan = cursor.fetchone()[0]
+        cursor.execute("DEALLOCATE plan_check_stmt")
+    else:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = list(plan_nodes(plan[0]["Plan"]))
+
+    indexes = {n.get("Index Name") for n in nodes if n.get("Index Name")}
+    seq_scans = [n for n in nodes if n["Node Type"] == "Seq Scan" and n.get("Relation Name") == "memes"]
+    sorts = [n for n in nodes if n["Node Type"] in ("Sort", "Incremental Sort")]
+
+    ok = expected_index in indexes and not seq_scans and not sorts
+    summary = " -> ".join(
+        n["Node Type"] + (f" [{n['Index Name']}]" if n.get("Index Name") else "") for n in nodes
+    )
+    if ok:
+        logger.info(f"✅ {label}: {summary}")
+    else:
+        logger.error(f"❌ {label}: expected {expected_index}, got {summary}")
+    return ok
+
+
+def run_checks(rows=PLAN_CHECK_ROWS):
+    """Seed, index and EXPLAIN inside a rolled-back transaction; returns True if every plan is good"""
+    if not DATABASE_URL:
+        logger.error("❌ DATABASE_URL not found!")
+        return False
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA {PLAN_CHECK_SCHEMA}")
+            cursor.execute(f"SET LOCAL search_path TO {PLAN_CHECK_SCHEMA}")
+            for _, _, sql in MIGRATIONS:
+                cursor.execute(sql)
+
+            logger.info(f"🌱 Seeding {rows:,} memes...")
+            cursor.execute(SEED_ROWS_SQL, (rows,))
+            cursor.execute("ANALYZE memes")
+
+            results = [check_plan(cursor, *check) for check in CHECKS]
+    finally:
+        conn.rollback()
+        conn.close()
+
+    passed = sum(results)
+    logger.info(f"📊 {passed}/{len(results)} queue queries use their index")
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else PLAN_CHECK_ROWS
+    if run_checks(rows):
+        print("✅ All queue queries use their indexes")
+    else:
+        print("❌ Query plan regression detected")
+        exit(1)
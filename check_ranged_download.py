@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Ranged download check
+Serves a random file from a local http.server with Range support and checks
+that ranged_download.py fetches it over parallel connections, saves progress
+while parts are still streaming, resumes after the connections drop, and
+rejects downloads whose length does not match.
+"""
+
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Fail fast: a dropped connection should end the download, not be retried
+os.environ.setdefault("RANGED_RETRIES", "0")
+import ranged_download
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHECK_FILE_SIZE = 10 * 1024 * 1024 + 123
+
+
+class FileServer(ThreadingHTTPServer):
+    """Serves `data`; `delay` holds each range open a moment so overlap is visible,
+    `stall` stops every range halfway until released, then drops it"""
+
+    daemon_threads = True
+
+    def __init__(self, data):
+        super().__init__(("127.0.0.1", 0), RangeHandler)
+        self.data = data
+        self.ranges = True
+        self.short_body = False
+        self.delay = 0.0
+        self.stall = None
+        self.bytes_sent = 0
+        self.active = 0
+        self.max_active = 0
+        self.range_requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/media.mp4"
+
+    def reset_counters(self):
+        with self.lock:
+            self.bytes_sent = self.max_active = self.range_requests = 0
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.data)))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "video/mp4")
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if not (server.ranges and match):
+            body = server.data[:len(server.data) // 2] if server.short_body else server.data
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(server.data)))
+            self.end_headers()
+            self._send(body)
+            return
+
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(server.data) - 1
+        body = server.data[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(server.data)}")
+        self.end_headers()
+
+        with server.lock:
+            server.range_requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(server.delay)
+            stall = server.stall
+            if stall is None:
+                self._send(body)
+                return
+            self._send(body[:len(body) // 2])
+            stall.wait(30)
+            self.connection.shutdown(2)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _send(self, body):
+        self.wfile.write(body)
+        self.wfile.flush()
+        with self.server.lock:
+            self.server.bytes_sent += len(body)
+
+
+def saved_progress(path):
+    try:
+        with open(path) as f:
+            return sum(json.load(f)["done"])
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def check_parallel(server, dest):
+    """A clean download arrives intact over more than one connection"""
+    server.reset_counters()
+    server.delay = 0.2
+    try:
+        content_type = ranged_download.download_file(server.url, dest, expected_size=len(server.data))
+    finally:
+        server.delay = 0.0
+    with open(dest, "rb") as f:
+        intact = f.read() == server.data
+    ok = content_type == "video/mp4" and intact and server.max_active > 1
+    logger.info(f"{'✅' if ok else '❌'} Parallel: {server.range_requests} range request(s), "
+                f"{server.max_active} at once, content {'matches' if intact else 'differs'}")
+    os.unlink(dest)
+    return ok
+
+
+def check_resume(server, dest):
+    """Progress is on disk mid-download, and a second call fetches only what is missing"""
+    progress_path = f"{dest}.progress"
+    server.reset_counters()
+    server.stall = threading.Event()
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(
+        content_type=ranged_download.download_file(server.url, dest, expected_size=len(server.data))))
+    worker.start()
+
+    deadline = time.time() + 20
+    while time.time() < deadline and not saved_progress(progress_path):
+        time.sleep(0.05)
+    saved_mid_download = saved_progress(progress_path)
+
+    # The server drops every connection: the first attempt fails and leaves its progress behind
+    server.stall.set()
+    worker.join(30)
+    server.stall = None
+    left_behind = saved_progress(progress_path)
+
+    server.reset_counters()
+    content_type = ranged_download.download_file(server.url, dest, expected_size=len(server.data))
+    with open(dest, "rb") as f:
+        intact = f.read() == server.data
+    refetched = server.bytes_sent
+
+    ok = (saved_mid_download > 0 and result.get("content_type") is None and left_behind > 0
+          and content_type == "video/mp4" and intact and refetched == len(server.data) - left_behind
+          and not os.path.exists(progress_path))
+    logger.info(f"{'✅' if ok else '❌'} Resume: {saved_mid_download:,} bytes saved mid-download, "
+                f"{left_behind:,} kept after the drop, {refetched:,} refetched, "
+                f"content {'matches' if intact else 'differs'}")
+    os.unlink(dest)
+    return ok
+
+
+def check_length_mismatch(server, dest):
+    """A size that changed since fetch follows the live length; a short body is rejected"""
+    changed = ranged_download.download_file(server.url, dest, expected_size=len(server.data) + 1)
+    changed_size = os.path.getsize(dest) if os.path.exists(dest) else 0
+
+    server.ranges = False
+    server.short_body = True
+    try:
+        short = ranged_download.download_file(server.url, dest, expected_size=len(server.data))
+    finally:
+        server.ranges = True
+        server.short_body = False
+
+    ok = changed is not None and changed_size == len(server.data) and short is None
+    logger.info(f"{'✅' if ok else '❌'} Length mismatch: changed size "
+                f"{'accepted' if changed is not None else 'rejected'} ({changed_size:,} of "
+                f"{len(server.data):,} bytes), short body "
+                f"{'rejected' if short is None else 'accepted'}")
+    if os.path.exists(dest):
+        os.unlink(dest)
+    return ok
+
+
+def run_checks():
+    server = FileServer(os.urandom(CHECK_FILE_SIZE))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dest = os.path.join(tmp_dir, "media.part")
+            results = [check(server, dest) for check in (check_parallel, check_resume, check_length_mismatch)]
+    finally:
+        server.shutdown()
+    return all(results)
+
+
+if __name__ == "__main__":
+    if run_checks():
+        print("✅ Ranged downloads are parallel, resumable and length-checked")
+    else:
+        print("❌ Ranged download check failed")
+        exit(1)
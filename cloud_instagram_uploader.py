@@ -2,21 +2,22 @@ import os
 import time
 import random
 import json
-import psycopg2
+import socket
 from psycopg2.extras import RealDictCursor
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.service import Service
 import logging
 from datetime import datetime
 import requests
-import tempfile
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import db_pool
+import media_cache
+import meme_stats
+import migrate_db
+import ranged_download
+from media_normalize import normalize_for_instagram
+from pacing import Pacer
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -28,177 +29,323 @@ INSTAGRAM_PASSWORD = os.getenv("INSTAGRAM_PASSWORD")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 STATE_FILE = "upload_state.json"
+# The database records posted state; the state file only keeps a short recent window
+STATE_RECENT_LIMIT = int(os.getenv("STATE_RECENT_LIMIT", 50))
+# Saved cookies/localStorage so we only do a full login when the session expires
+SESSION_FILE = os.getenv("INSTAGRAM_SESSION_FILE", "instagram_session.json")
+# Optional persistent Chrome profile (keeps the session inside Chrome itself)
+CHROME_USER_DATA_DIR = os.getenv("CHROME_USER_DATA_DIR")
+# How many queued memes to download ahead while the browser starts
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", 3))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", 2))
+
+# Queue claims: each uploader leases the memes it is working on
+UPLOADER_WORKER_ID = os.getenv("UPLOADER_WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+UPLOAD_LEASE_SECONDS = int(os.getenv("UPLOAD_LEASE_SECONDS", 900))
+# Attempts at recording a published meme before falling back to pinning its lease
+MARK_POSTED_RETRIES = int(os.getenv("MARK_POSTED_RETRIES", 3))
+
+# Seconds to wait for Instagram to confirm a share
+SHARE_CONFIRM_TIMEOUT = int(os.getenv("SHARE_CONFIRM_TIMEOUT", 120))
+
+# Selenium is imported inside the browser functions, not at module import, so
+# locators use the plain strategy strings behind By.XPATH / By.CSS_SELECTOR
+XPATH = "xpath"
+CSS_SELECTOR = "css selector"
+
+CREATE_BUTTON = (XPATH, "//span[text()='Create']")
+FILE_INPUT = (CSS_SELECTOR, "input[type='file']")
+NEXT_BUTTON = (XPATH, "//button[contains(text(), 'Next')]")
+SHARE_BUTTON = (XPATH, "//button[contains(text(), 'Share')]")
+CAPTION_AREA = (CSS_SELECTOR, "textarea[aria-label*='caption']")
+SHARE_CONFIRMATION = (XPATH, "//*[contains(text(), 'Your post has been shared') or contains(text(), 'Post shared')]"
+                             " | //img[@alt='Animated checkmark']")
+EXPLORE_LINK = (XPATH, "//a[contains(@href, '/explore/')]")
+
+# Read in one script call so a re-rendering header can't go stale mid-read
+DIALOG_TITLE_SCRIPT = """
+    const heading = document.querySelector("div[role='dialog'] h1");
+    return heading ? heading.textContent : null;
+"""
+
 HASHTAGS = "#memes #funny #relatable #comedy #viral #trending #lol #dankmemes #funnymemes #memesdaily #humor #laughs #mood #same #facts #reddit"
 
+def logged_in_markers():
+    """Condition that holds once a logged-in-only element is on the page"""
+    from selenium.webdriver.support import expected_conditions as EC
+    return EC.any_of(
+        EC.presence_of_element_located(EXPLORE_LINK),
+        EC.presence_of_element_located(CREATE_BUTTON)
+    )
+
 def ensure_database_schema():
-    """Ensure database has required columns"""
+    """Check the database schema version (cached; DDL lives in migrate_db.py)"""
     if not DATABASE_URL:
         return False
     
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cursor = conn.cursor()
-        
-        # Add missing columns if they don't exist
-        cursor.execute("""
-            ALTER TABLE memes 
-            ADD COLUMN IF NOT EXISTS uploaded_to_instagram BOOLEAN DEFAULT FALSE,
-            ADD COLUMN IF NOT EXISTS uploaded_at TIMESTAMP DEFAULT NULL,
-            ADD COLUMN IF NOT EXISTS instagram_post_id VARCHAR(50) DEFAULT NULL;
-        """)
-        
-        # Create indexes
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_memes_uploaded_instagram ON memes(uploaded_to_instagram);
-            CREATE INDEX IF NOT EXISTS idx_memes_score ON memes(score DESC);
-        """)
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        logger.info("✅ Database schema verified/updated")
-        return True
+        if migrate_db.ensure_schema():
+            return True
+        logger.error("❌ Database schema is out of date")
+        return False
         
     except Exception as e:
-        logger.error(f"❌ Database schema update failed: {e}")
+        logger.error(f"❌ Database schema check failed: {e}")
         return False
 
 def get_database_connection():
-    """Get database connection"""
+    """Borrow a pooled database connection (use as a context manager)"""
+    return db_pool.get_connection(cursor_factory=RealDictCursor)
+
+def check_database_connection():
+    """Check that the database is reachable"""
     try:
-        if DATABASE_URL:
-            logger.info("🔌 Connecting to PostgreSQL...")
-            conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-            logger.info("✅ Database connection successful")
-            return conn
-        else:
-            logger.error("❌ No DATABASE_URL found!")
-            return None
+        with db_pool.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        logger.info("✅ Database connection successful")
+        return True
     except Exception as e:
         logger.error(f"❌ Database connection failed: {e}")
-        return None
+        return False
 
-def get_memes_from_database(posted_ids=None):
-    """Fetch unposted memes from database"""
-    logger.info("📋 Fetching memes from database...")
+claim_stats = {"claims": 0, "claimed": 0, "reclaimed": 0, "total_ms": 0.0, "last_ms": 0.0, "max_ms": 0.0}
+claim_stats_lock = threading.Lock()
+
+def record_claim(elapsed_ms, claimed, reclaimed):
+    with claim_stats_lock:
+        claim_stats["claims"] += 1
+        claim_stats["claimed"] += claimed
+        claim_stats["reclaimed"] += reclaimed
+        claim_stats["total_ms"] += elapsed_ms
+        claim_stats["last_ms"] = elapsed_ms
+        claim_stats["max_ms"] = max(claim_stats["max_ms"], elapsed_ms)
+
+def get_claim_stats():
+    """Claim counters plus average latency in milliseconds"""
+    with claim_stats_lock:
+        stats = dict(claim_stats)
+    stats["avg_ms"] = stats["total_ms"] / stats["claims"] if stats["claims"] else 0.0
+    return stats
+
+# Served by the idx_memes_upload_queue partial index (see migrate_db.py)
+CLAIM_MEMES_SQL = """
+    WITH candidates AS (
+        SELECT id, claim_expires_at AS previous_expiry
+        FROM memes 
+        WHERE url IS NOT NULL 
+        AND (
+            (uploaded_to_instagram IS NULL) OR 
+            (uploaded_to_instagram = FALSE)
+        )
+        AND (claim_expires_at IS NULL OR claim_expires_at < NOW())
+        AND id <> ALL(%s)
+        ORDER BY score DESC, id DESC
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE memes m
+    SET claimed_by = %s, claim_expires_at = NOW() + make_interval(secs => %s)
+    FROM candidates c
+    WHERE m.id = c.id
+    RETURNING m.id, m.post_id as reddit_id, m.title, m.url, m.file_type, m.file_size, m.score,
+              c.previous_expiry IS NOT NULL AS reclaimed
+"""
+
+def get_memes_from_database(limit=10):
+    """Claim the best unposted memes for this uploader
     
-    if posted_ids is None:
-        posted_ids = []
+    Selected rows are leased to UPLOADER_WORKER_ID for UPLOAD_LEASE_SECONDS
+    in one statement; rows other uploaders hold are skipped and expired
+    leases are reclaimed, so parallel uploaders never pick the same meme.
+    Memes in the local recent-upload window are never claimed, even if the
+    database missed marking them posted.
+    """
+    logger.info("📋 Claiming memes from database...")
+    recent_ids = [int(meme_id) for meme_id in load_state().get("recent_meme_ids", [])]
     
-    conn = get_database_connection()
-    if not conn:
+    try:
+        with get_database_connection() as conn:
+            cursor = conn.cursor()
+            started = time.time()
+            cursor.execute(CLAIM_MEMES_SQL, (recent_ids, limit, UPLOADER_WORKER_ID, UPLOAD_LEASE_SECONDS))
+            
+            memes = [dict(meme) for meme in cursor.fetchall()]
+            memes.sort(key=lambda m: (m['score'] or 0, m['id']), reverse=True)
+            elapsed_ms = (time.time() - started) * 1000
+            reclaimed = sum(1 for m in memes if m.pop('reclaimed'))
+            record_claim(elapsed_ms, len(memes), reclaimed)
+            
+            logger.info(f"🔒 Claimed {len(memes)} memes in {elapsed_ms:.1f} ms"
+                        f"{f' ({reclaimed} from expired leases)' if reclaimed else ''}")
+            return memes
+    except Exception as e:
+        # No unleased fallback: it could hand one meme to two uploaders, or a published one again
+        logger.error(f"❌ Error claiming memes: {e}")
         return []
-    
+
+def release_memes(meme_ids):
+    """Hand back leases this uploader holds on memes it did not post"""
+    if not meme_ids:
+        return
     try:
-        cursor = conn.cursor()
-        
-        # Get unposted memes - handle both old and new schema
-        if posted_ids:
-            placeholders = ','.join(['%s'] * len(posted_ids))
-            query = f"""
-            SELECT id, post_id as reddit_id, title, url, file_type, score
-            FROM memes 
-            WHERE id NOT IN ({placeholders})
-            AND url IS NOT NULL 
-            AND (
-                (uploaded_to_instagram IS NULL) OR 
-                (uploaded_to_instagram = FALSE)
-            )
-            ORDER BY score DESC, id DESC
-            LIMIT 10
-            """
-            cursor.execute(query, posted_ids)
-        else:
-            query = """
-            SELECT id, post_id as reddit_id, title, url, file_type, score
-            FROM memes 
-            WHERE url IS NOT NULL 
-            AND (
-                (uploaded_to_instagram IS NULL) OR 
-                (uploaded_to_instagram = FALSE)
-            )
-            ORDER BY score DESC, id DESC
-            LIMIT 10
-            """
-            cursor.execute(query)
-        
-        memes = cursor.fetchall()
-        logger.info(f"📊 Found {len(memes)} unposted memes")
-        
-        return [dict(meme) for meme in memes]
-        
+        with get_database_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE memes
+                    SET claimed_by = NULL, claim_expires_at = NULL
+                    WHERE id = ANY(%s) AND claimed_by = %s
+                """, (list(meme_ids), UPLOADER_WORKER_ID))
+        logger.info(f"🔓 Released {len(meme_ids)} claimed memes")
     except Exception as e:
-        logger.error(f"❌ Error fetching memes: {e}")
-        # Fallback query for databases without new columns
-        try:
-            cursor.execute("""
-                SELECT id, post_id as reddit_id, title, url, file_type, 
-                       COALESCE(score, 0) as score
-                FROM memes 
-                WHERE url IS NOT NULL 
-                ORDER BY COALESCE(score, 0) DESC, id DESC
-                LIMIT 10
-            """)
-            memes = cursor.fetchall()
-            logger.info(f"📊 Fallback: Found {len(memes)} memes")
-            return [dict(meme) for meme in memes]
-        except Exception as e2:
-            logger.error(f"❌ Fallback query also failed: {e2}")
-            return []
-    finally:
-        if conn:
-            conn.close()
+        logger.error(f"❌ Error releasing claims: {e}")
+
+def guess_extension(url, content_type):
+    """File extension from the response content type, falling back to the URL"""
+    content_type = (content_type or '').lower()
+    if 'image/jpeg' in content_type or url.lower().endswith(('.jpg', '.jpeg')):
+        return '.jpg'
+    elif 'image/png' in content_type or url.lower().endswith('.png'):
+        return '.png'
+    elif 'image/gif' in content_type or url.lower().endswith('.gif'):
+        return '.gif'
+    elif 'video/mp4' in content_type or url.lower().endswith('.mp4'):
+        return '.mp4'
+    return '.jpg'
+
+def update_file_size(meme_id, file_size):
+    """Replace a stale fetch-time memes.file_size with the size actually downloaded"""
+    try:
+        with get_database_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("UPDATE memes SET file_size = %s WHERE id = %s", (file_size, meme_id))
+        logger.info(f"📏 Updated file size of meme {meme_id} to {file_size:,} bytes")
+    except Exception as e:
+        logger.error(f"❌ Error updating file size: {e}")
 
-def download_meme_file(url, meme_id):
-    """Download meme file from URL"""
+def download_meme_file(url, meme_id, file_type=None, expected_size=None):
+    """Download meme file from URL
+    
+    Videos and large files use parallel, resumable range requests. The live
+    size wins over `expected_size` (memes.file_size); a changed size is
+    written back to the meme row.
+    """
     try:
+        cache = media_cache.get_cache()
+        cached = cache.lookup(url)
+        if cached:
+            temp_file = cache.materialize(cached, prefix=f"meme_{meme_id}_")
+            logger.info(f"✅ Cache hit for meme {meme_id}: {os.path.basename(temp_file)}")
+            return temp_file
+        
         logger.info(f"📥 Downloading meme {meme_id}...")
         
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         
-        response = requests.get(url, headers=headers, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        # Determine file extension
-        content_type = response.headers.get('content-type', '').lower()
-        if 'image/jpeg' in content_type or url.lower().endswith(('.jpg', '.jpeg')):
-            ext = '.jpg'
-        elif 'image/png' in content_type or url.lower().endswith('.png'):
-            ext = '.png'
-        elif 'image/gif' in content_type or url.lower().endswith('.gif'):
-            ext = '.gif'
-        elif 'video/mp4' in content_type or url.lower().endswith('.mp4'):
-            ext = '.mp4'
+        if file_type == 'video' or (expected_size or 0) >= ranged_download.RANGED_MIN_SIZE:
+            part_path = cache.partial_path(url)
+            content_type = ranged_download.download_file(url, part_path, headers, expected_size)
+            if content_type is None:
+                return None
+            cached = cache.store_file(url, part_path, guess_extension(url, content_type), min_size=1024)
         else:
-            ext = '.jpg'
-        
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=ext, prefix=f"meme_{meme_id}_")
-        
-        # Download file
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                temp_file.write(chunk)
-        
-        temp_file.close()
+            response = requests.get(url, headers=headers, stream=True, timeout=30)
+            response.raise_for_status()
+            
+            # Download file into the cache (files under 1 KB are rejected)
+            ext = guess_extension(url, response.headers.get('content-type', ''))
+            cached = cache.store(url, response.iter_content(chunk_size=8192), ext, min_size=1024)
         
-        # Check file size
-        file_size = os.path.getsize(temp_file.name)
-        if file_size < 1024:
-            os.unlink(temp_file.name)
-            logger.error(f"❌ File too small: {file_size} bytes")
+        if not cached:
+            logger.error("❌ File too small: under 1024 bytes")
             return None
         
-        logger.info(f"✅ Downloaded: {os.path.basename(temp_file.name)} ({file_size:,} bytes)")
-        return temp_file.name
+        temp_file = cache.materialize(cached, prefix=f"meme_{meme_id}_")
+        file_size = os.path.getsize(temp_file)
+        logger.info(f"✅ Downloaded: {os.path.basename(temp_file)} ({file_size:,} bytes)")
+        if expected_size and file_size != expected_size:
+            update_file_size(meme_id, file_size)
+        return temp_file
         
     except Exception as e:
         logger.error(f"❌ Download error: {e}")
         return None
 
+def validate_media_file(file_path, file_type):
+    """Check a downloaded file is a readable image / plausible MP4"""
+    try:
+        if file_type == 'video' or file_path.endswith('.mp4'):
+            with open(file_path, 'rb') as f:
+                header = f.read(12)
+            return header[4:8] == b'ftyp'
+        
+        with Image.open(file_path) as img:
+            img.verify()
+        return True
+    except Exception as e:
+        logger.error(f"❌ Invalid media file {os.path.basename(file_path)}: {e}")
+        return False
+
+def download_and_validate(meme):
+    """Download a meme, verify it and normalize it for upload; returns the local path or None"""
+    temp_file = download_meme_file(meme['url'], meme['id'], meme.get('file_type'), meme.get('file_size'))
+    if not temp_file:
+        return None
+    
+    if not validate_media_file(temp_file, meme.get('file_type')):
+        cleanup_temp_file(temp_file)
+        return None
+    
+    normalized = normalize_for_instagram(temp_file, meme.get('file_type'), prefix=f"meme_{meme['id']}_")
+    if normalized != temp_file:
+        cleanup_temp_file(temp_file)
+    return normalized
+
+class MediaPrefetch:
+    """Downloads and validates the next few queued memes in the background"""
+    
+    def __init__(self, memes, workers=PREFETCH_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prefetch")
+        self._pending = [(meme, self._executor.submit(download_and_validate, meme)) for meme in memes]
+        self._lock = threading.Lock()
+        logger.info(f"⏬ Prefetching {len(memes)} memes in the background")
+    
+    def next_ready(self):
+        """Next meme (in queue order) whose file downloaded and validated; (None, None) when exhausted"""
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return None, None
+                meme, future = self._pending.pop(0)
+            
+            temp_file = future.result()
+            if temp_file:
+                logger.info(f"🎯 Selected: {meme['title'][:50]}... (Score: {meme.get('score', 0)})")
+                return meme, temp_file
+            logger.warning(f"⚠️ Skipping meme {meme['id']}: download or validation failed")
+    
+    def close(self):
+        """Stop outstanding downloads, delete files nobody took and release their claims
+        
+        Memes whose download failed keep their lease until it expires, which
+        stops every uploader from immediately retrying a broken URL.
+        """
+        with self._lock:
+            leftovers, self._pending = self._pending, []
+        for _, future in leftovers:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        released = []
+        for meme, future in leftovers:
+            if future.cancelled():
+                released.append(meme['id'])
+            elif future.exception() is None and future.result():
+                cleanup_temp_file(future.result())
+                released.append(meme['id'])
+        release_memes(released)
+
 def format_caption(meme_data):
     """Format Instagram caption"""
     title = meme_data.get('title', 'Funny meme')
@@ -210,13 +357,11 @@ def format_caption(meme_data):
     caption = f"{title}\n\n🔥 Fresh from Reddit 🔥\n\n{HASHTAGS}"
     return caption
 
-def human_delay(min_seconds=2, max_seconds=5):
-    """Human-like delay"""
-    delay = random.uniform(min_seconds, max_seconds)
-    time.sleep(delay)
-
 def setup_driver():
     """Setup Chrome driver with flexible ChromeDriver location"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
     logger.info("🔧 Setting up Chrome driver...")
     
     # Check Chrome
@@ -259,7 +404,6 @@ def setup_driver():
             if "Test" in driver.page_source:
                 logger.info(f"✅ ChromeDriver working: {path}")
                 driver.set_page_load_timeout(60)
-                driver.implicitly_wait(10)
                 return driver
             else:
                 driver.quit()
@@ -274,83 +418,77 @@ def setup_driver():
 
 def instagram_login(driver, username, password):
     """Stealth Instagram login that bypasses bot detection"""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.common.action_chains import ActionChains
+    from selenium.webdriver.common.keys import Keys
+    from selenium.common.exceptions import TimeoutException
     logger.info(f"🥷 Stealth login for: {username}")
+    pacer = Pacer(driver, "login")
 
     try:
-        # Navigate to login
-        driver.get("https://www.instagram.com/accounts/login/")
-        time.sleep(random.uniform(10, 18))
+        with pacer.step("open login page"):
+            # Navigate to login
+            driver.get("https://www.instagram.com/accounts/login/")
 
-        # Handle cookies
-        try:
-            cookie_btn = WebDriverWait(driver, 5).until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Accept')]"))
+            # Handle cookies
+            try:
+                cookie_btn = pacer.wait_for(
+                    EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Accept')]")), 5, jitter=False
+                )
+                ActionChains(driver).move_to_element(cookie_btn).pause(0.5).click().perform()
+                pacer.wait_for(EC.staleness_of(cookie_btn), 5)
+            except TimeoutException:
+                pass
+
+            # Wait for form
+            username_field = pacer.wait_for(
+                EC.element_to_be_clickable((By.CSS_SELECTOR, "input[name='username']")), 20
             )
-            ActionChains(driver).move_to_element(cookie_btn).pause(0.5).click().perform()
-            time.sleep(random.uniform(2, 4))
-        except:
-            pass
-
-        # Wait for form
-        username_field = WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, "input[name='username']"))
-        )
 
-        # Human-like interaction
-        ActionChains(driver).move_to_element(username_field).pause(0.5).click().perform()
-        time.sleep(random.uniform(1, 2))
+        with pacer.step("enter credentials"):
+            # Human-like interaction
+            ActionChains(driver).move_to_element(username_field).pause(0.5).click().perform()
+            username_field.clear()
 
-        username_field.clear()
-        time.sleep(random.uniform(1, 2))
+            # Human-like typing
+            for char in username:
+                username_field.send_keys(char)
+                time.sleep(random.uniform(0.15, 0.45))
 
-        # Human-like typing
-        for char in username:
-            username_field.send_keys(char)
-            time.sleep(random.uniform(0.15, 0.45))
+            # Tab to password
+            pacer.jitter()
+            username_field.send_keys(Keys.TAB)
 
-        # Tab to password
-        time.sleep(random.uniform(2, 4))
-        username_field.send_keys(Keys.TAB)
-        time.sleep(random.uniform(1, 2))
-
-        password_field = driver.find_element(By.CSS_SELECTOR, "input[name='password']")
-        password_field.clear()
-        time.sleep(random.uniform(1, 2))
+            password_field = pacer.wait_for(
+                EC.element_to_be_clickable((By.CSS_SELECTOR, "input[name='password']")), 10, jitter=False
+            )
+            password_field.clear()
 
-        # Type password
-        for char in password:
-            password_field.send_keys(char)
-            time.sleep(random.uniform(0.15, 0.4))
+            # Type password
+            for char in password:
+                password_field.send_keys(char)
+                time.sleep(random.uniform(0.15, 0.4))
 
-        # Human thinking pause
-        time.sleep(random.uniform(5, 10))
+            # Human thinking pause
+            pacer.jitter()
 
-        # Submit
-        password_field.send_keys(Keys.RETURN)
-        time.sleep(random.uniform(15, 25))
+        with pacer.step("submit"):
+            # Submit and wait until Instagram navigates away from the login form
+            password_field.send_keys(Keys.RETURN)
+            try:
+                pacer.wait_for(lambda d: "/accounts/login" not in d.current_url, 30, jitter=False)
+            except TimeoutException:
+                pass
 
         # Check success
         if "/accounts/login" not in driver.current_url:
             try:
-                WebDriverWait(driver, 10).until(
-                    EC.any_of(
-                        EC.presence_of_element_located((By.XPATH, "//a[contains(@href, '/explore/')]")),
-                        EC.presence_of_element_located((By.XPATH, "//span[text()='Create']"))
-                    )
-                )
+                with pacer.step("confirm login"):
+                    pacer.wait_for(logged_in_markers(), 10)
                 logger.info("🎉 Stealth login successful!")
 
-                # Handle popups
-                for _ in range(3):
-                    try:
-                        popup = WebDriverWait(driver, 3).until(
-                            EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Not Now')]"))
-                        )
-                        ActionChains(driver).move_to_element(popup).pause(0.5).click().perform()
-                        time.sleep(random.uniform(2, 4))
-                    except:
-                        break
-
+                dismiss_popups(driver)
                 return True
             except:
                 logger.error("❌ Redirected but no logged-in elements")
@@ -363,9 +501,123 @@ def instagram_login(driver, username, password):
         logger.error(f"❌ Stealth login error: {e}")
         return False
 
+    finally:
+        pacer.report()
+
+def dismiss_popups(driver):
+    """Close 'Not Now' prompts (notifications, save login info)"""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.common.action_chains import ActionChains
+    for _ in range(3):
+        try:
+            popup = WebDriverWait(driver, 3).until(
+                EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Not Now')]"))
+            )
+            ActionChains(driver).move_to_element(popup).pause(0.5).click().perform()
+            WebDriverWait(driver, 5).until(EC.staleness_of(popup))
+        except:
+            break
+
+def is_logged_in(driver, timeout=8):
+    """Cheap session check: session cookie plus a logged-in-only element"""
+    from selenium.webdriver.support.ui import WebDriverWait
+    if not driver.get_cookie("sessionid") or "/accounts/login" in driver.current_url:
+        return False
+    try:
+        WebDriverWait(driver, timeout).until(logged_in_markers())
+        return True
+    except:
+        return False
+
+def save_session(driver, username, path=SESSION_FILE):
+    """Serialize cookies and localStorage for the next run"""
+    try:
+        session = {
+            "username": username,
+            "saved_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "cookies": driver.get_cookies(),
+            "local_storage": driver.execute_script("return Object.assign({}, window.localStorage);") or {}
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(session, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+        logger.info(f"💾 Saved Instagram session ({len(session['cookies'])} cookies)")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Could not save session: {e}")
+        return False
+
+def restore_session(driver, username, path=SESSION_FILE):
+    """Restore a saved session and check it is still valid"""
+    # A persistent Chrome profile may already be logged in
+    if CHROME_USER_DATA_DIR:
+        driver.get("https://www.instagram.com/")
+        if is_logged_in(driver):
+            logger.info("♻️ Chrome profile session is still valid")
+            return True
+
+    if not os.path.exists(path):
+        return False
+
+    try:
+        with open(path, 'r') as f:
+            session = json.load(f)
+
+        if session.get("username") != username:
+            logger.info("ℹ️ Saved session belongs to another account, ignoring")
+            return False
+
+        # Cookies can only be set for the domain currently loaded
+        driver.get("https://www.instagram.com/")
+        driver.delete_all_cookies()
+        for cookie in session.get("cookies", []):
+            cookie = dict(cookie)
+            if "expiry" in cookie:
+                cookie["expiry"] = int(cookie["expiry"])
+            try:
+                driver.add_cookie(cookie)
+            except Exception:
+                continue
+
+        driver.execute_script(
+            "for (const [k, v] of Object.entries(arguments[0])) { window.localStorage.setItem(k, v); }",
+            session.get("local_storage", {})
+        )
+
+        driver.get("https://www.instagram.com/")
+        if is_logged_in(driver):
+            logger.info(f"♻️ Restored Instagram session saved at {session.get('saved_at')}")
+            dismiss_popups(driver)
+            return True
+
+        logger.info("⌛ Saved Instagram session is no longer valid")
+        return False
+
+    except Exception as e:
+        logger.error(f"❌ Could not restore session: {e}")
+        return False
+
+def ensure_logged_in(driver, username, password):
+    """Reuse the saved session when possible, otherwise do a full login"""
+    if restore_session(driver, username):
+        return True
+
+    if not instagram_login(driver, username, password):
+        return False
+
+    save_session(driver, username)
+    return True
+
 # Also update your setup_driver function:
 def setup_driver():
     """Enhanced driver setup for production"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
     logger.info("🔧 Setting up production driver...")
 
     chrome_options = Options()
@@ -381,6 +633,8 @@ def setup_driver():
     chrome_options.add_argument("--no-first-run")
     chrome_options.add_argument("--disable-default-apps")
     chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+    if CHROME_USER_DATA_DIR:
+        chrome_options.add_argument(f"--user-data-dir={CHROME_USER_DATA_DIR}")
 
     chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
     chrome_options.add_experimental_option('useAutomationExtension', False)
@@ -402,101 +656,130 @@ def setup_driver():
         logger.error(f"❌ Production driver setup failed: {e}")
         return None
         
+def dialog_title(driver):
+    """Heading of the open create-post dialog (e.g. Crop, Edit), or None"""
+    return driver.execute_script(DIALOG_TITLE_SCRIPT)
+
 def upload_post(driver, file_path, caption):
-    """Simplified Instagram upload"""
+    """Simplified Instagram upload
+    
+    Returns True once Instagram confirms the share, False if the upload
+    failed, and None if Share was clicked but never confirmed.
+    """
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
     logger.info(f"📤 Uploading: {os.path.basename(file_path)}")
+    pacer = Pacer(driver, "upload")
     
     try:
-        # Go home and find create button
-        driver.get("https://www.instagram.com/")
-        human_delay(3, 5)
+        with pacer.step("open home"):
+            # Go home and find create button
+            driver.get("https://www.instagram.com/")
+            create_btn = pacer.wait_for(EC.element_to_be_clickable(CREATE_BUTTON), 15)
         
-        create_btn = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.XPATH, "//span[text()='Create']"))
-        )
-        driver.execute_script("arguments[0].click();", create_btn)
-        human_delay(3, 5)
+        with pacer.step("open create dialog"):
+            driver.execute_script("arguments[0].click();", create_btn)
+            file_input = pacer.wait_for(EC.presence_of_element_located(FILE_INPUT), 15)
         
-        # Upload file
-        file_input = WebDriverWait(driver, 15).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='file']"))
-        )
-        file_input.send_keys(os.path.abspath(file_path))
-        human_delay(5, 8)
+        with pacer.step("attach media"):
+            # Upload file; the preview has rendered once "Next" is clickable
+            file_input.send_keys(os.path.abspath(file_path))
+            pacer.wait_for(EC.element_to_be_clickable(NEXT_BUTTON), 60, jitter=False)
         
-        # Click Next buttons
-        for i in range(3):
-            try:
-                next_btn = WebDriverWait(driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Next')]"))
-                )
+        with pacer.step("advance to caption"):
+            # Click Next buttons until the Share screen is reached
+            for i in range(3):
+                if driver.find_elements(*SHARE_BUTTON):
+                    break
+                title = dialog_title(driver)
+                next_btn = pacer.wait_for(EC.element_to_be_clickable(NEXT_BUTTON), 10, jitter=False)
                 driver.execute_script("arguments[0].click();", next_btn)
-                human_delay(3, 5)
-            except:
-                break
-        
-        # Add caption
-        try:
-            caption_area = WebDriverWait(driver, 8).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, "textarea[aria-label*='caption']"))
-            )
-            caption_area.clear()
-            caption_area.send_keys(caption)
-            human_delay(2, 4)
-        except:
-            logger.warning("⚠️ Could not add caption")
+                # The header often keeps the same Next node, so watch the screen itself;
+                # a timeout here fails the upload instead of skipping the remaining screens
+                pacer.wait_for(EC.any_of(
+                    EC.staleness_of(next_btn),
+                    EC.presence_of_element_located(SHARE_BUTTON),
+                    lambda d: dialog_title(d) != title
+                ), 15)
         
-        # Share
-        share_btn = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Share')]"))
-        )
-        driver.execute_script("arguments[0].click();", share_btn)
+        with pacer.step("caption"):
+            # Add caption
+            try:
+                caption_area = pacer.wait_for(EC.element_to_be_clickable(CAPTION_AREA), 8, jitter=False)
+                caption_area.clear()
+                caption_area.send_keys(caption)
+                pacer.jitter()
+            except TimeoutException:
+                logger.warning("⚠️ Could not add caption")
         
-        human_delay(15, 20)
-        logger.info("✅ Upload completed")
+        with pacer.step("share"):
+            # Share
+            share_btn = pacer.wait_for(EC.element_to_be_clickable(SHARE_BUTTON), 10, jitter=False)
+            driver.execute_script("arguments[0].click();", share_btn)
+            
+            try:
+                pacer.wait_for(EC.presence_of_element_located(SHARE_CONFIRMATION), SHARE_CONFIRM_TIMEOUT, jitter=False)
+                logger.info("✅ Upload completed")
+            except TimeoutException:
+                logger.error(f"❌ No share confirmation after {SHARE_CONFIRM_TIMEOUT}s")
+                return None
         return True
         
     except Exception as e:
         logger.error(f"❌ Upload failed: {e}")
         return False
+    
+    finally:
+        pacer.report()
 
 def mark_meme_as_posted(meme_id):
     """Mark meme as posted in database"""
     logger.info(f"📝 Marking meme {meme_id} as posted...")
     
-    conn = get_database_connection()
-    if not conn:
-        return False
-    
     try:
-        cursor = conn.cursor()
-        
-        # Try new schema first
-        try:
+        with get_database_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
                 UPDATE memes 
-                SET uploaded_to_instagram = TRUE, uploaded_at = %s 
+                SET uploaded_to_instagram = TRUE, uploaded_at = %s,
+                    claimed_by = NULL, claim_expires_at = NULL
                 WHERE id = %s
             """, (datetime.now(), meme_id))
-        except Exception:
-            # Fallback for old schema - add note to title or use a flag table
-            logger.info("Using fallback marking method")
-            cursor.execute("""
-                UPDATE memes 
-                SET title = title || ' [POSTED]'
-                WHERE id = %s AND title NOT LIKE '%[POSTED]%'
-            """, (meme_id,))
         
-        conn.commit()
+        meme_stats.invalidate()
         logger.info(f"✅ Marked meme {meme_id} as posted")
         return True
         
     except Exception as e:
         logger.error(f"❌ Error marking as posted: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
+
+def record_published(meme_id):
+    """Record a meme that is already live on Instagram; never lets it be claimed again
+    
+    The meme goes into the local recent window first (the claim query skips
+    it from then on), then the database mark is retried. If the database
+    still refuses, the lease is pinned so other uploaders can't claim the
+    row, and the next reconcile_legacy_state() marks it posted.
+    """
+    record_upload(meme_id)
+    for attempt in range(1, MARK_POSTED_RETRIES + 1):
+        if mark_meme_as_posted(meme_id):
+            return True
+        if attempt < MARK_POSTED_RETRIES:
+            time.sleep(2 ** attempt)
+    
+    logger.error(f"❌ Meme {meme_id} is live but not marked posted; keeping its lease")
+    try:
+        with get_database_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE memes SET claim_expires_at = 'infinity'
+                    WHERE id = %s AND claimed_by = %s
+                """, (meme_id, UPLOADER_WORKER_ID))
+    except Exception as e:
+        logger.error(f"❌ Could not pin lease on meme {meme_id}: {e}")
+    return False
 
 def load_state():
     """Load upload state"""
@@ -505,8 +788,8 @@ def load_state():
             with open(STATE_FILE, 'r') as f:
                 return json.load(f)
         except:
-            return {"posted_meme_ids": [], "last_upload_date": ""}
-    return {"posted_meme_ids": [], "last_upload_date": ""}
+            return {"recent_meme_ids": [], "last_upload_date": ""}
+    return {"recent_meme_ids": [], "last_upload_date": ""}
 
 def save_state(state):
     """Save upload state"""
@@ -516,11 +799,72 @@ def save_state(state):
     except Exception as e:
         logger.error(f"Error saving state: {e}")
 
-def main():
-    """Main function"""
-    logger.info("🚀 Starting Instagram uploader...")
-    logger.info("=" * 60)
+def record_upload(meme_id):
+    """Remember a successful upload in the bounded recent window"""
+    state = load_state()
+    recent = state.get("recent_meme_ids", []) + [meme_id]
+    state["recent_meme_ids"] = recent[-STATE_RECENT_LIMIT:]
+    state["last_upload_date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    save_state(state)
+
+def reconcile_legacy_state():
+    """One-time fold of the old unbounded posted_meme_ids list into the memes table
+    
+    The list is only dropped from the state file once the database has
+    recorded every id in it, so a failed attempt is retried on the next run.
+    """
+    state = load_state()
+    legacy_ids = state.get("posted_meme_ids")
+    if legacy_ids is None:
+        # Catch up on recent uploads whose database mark failed
+        return mark_recent_uploads(state.get("recent_meme_ids", []))
     
+    try:
+        with get_database_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE memes
+                    SET uploaded_to_instagram = TRUE, uploaded_at = COALESCE(uploaded_at, %s)
+                    WHERE id = ANY(%s)
+                    AND (uploaded_to_instagram IS NULL OR uploaded_to_instagram = FALSE)
+                """, (datetime.now(), list(legacy_ids)))
+                updated = cursor.rowcount
+    except Exception as e:
+        logger.error(f"❌ Legacy state reconciliation failed: {e}")
+        return False
+    
+    recent = state.get("recent_meme_ids", []) + legacy_ids
+    state["recent_meme_ids"] = recent[-STATE_RECENT_LIMIT:]
+    del state["posted_meme_ids"]
+    save_state(state)
+    logger.info(f"🔁 Reconciled {len(legacy_ids)} legacy posted ids ({updated} newly marked in database)")
+    return True
+
+def mark_recent_uploads(recent_ids):
+    """Mark memes from the recent window as posted if the database missed them"""
+    if not recent_ids:
+        return True
+    try:
+        with get_database_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE memes
+                    SET uploaded_to_instagram = TRUE, uploaded_at = COALESCE(uploaded_at, %s),
+                        claimed_by = NULL, claim_expires_at = NULL
+                    WHERE id = ANY(%s)
+                    AND (uploaded_to_instagram IS NULL OR uploaded_to_instagram = FALSE)
+                """, (datetime.now(), list(recent_ids)))
+                updated = cursor.rowcount
+    except Exception as e:
+        logger.error(f"❌ Recent upload reconciliation failed: {e}")
+        return False
+    if updated:
+        meme_stats.invalidate()
+        logger.info(f"🔁 Marked {updated} recently uploaded memes as posted")
+    return True
+
+def check_prerequisites():
+    """Check credentials and database before doing any work"""
     # Check credentials
     if not all([INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD]):
         logger.error("❌ Missing Instagram credentials!")
@@ -532,75 +876,100 @@ def main():
     
     logger.info(f"✅ Credentials loaded for: {INSTAGRAM_USERNAME}")
     
-    # Ensure database schema
+    # Check database schema version
     if not ensure_database_schema():
-        logger.warning("⚠️ Database schema update failed, trying anyway...")
+        logger.warning("⚠️ Database schema check failed, trying anyway...")
     
     # Test database
-    test_conn = get_database_connection()
-    if not test_conn:
+    if not check_database_connection():
         logger.error("❌ Database connection failed!")
         return False
-    test_conn.close()
-    
-    # Load state
-    state = load_state()
-    posted_ids = state.get("posted_meme_ids", [])
-    logger.info(f"📊 Previously posted: {len(posted_ids)} memes")
     
-    # Get memes
-    memes = get_memes_from_database(posted_ids)
+    reconcile_legacy_state()
+    return True
+
+def start_prefetch(count=PREFETCH_COUNT):
+    """Pick the best unposted memes and start downloading them; returns a MediaPrefetch or None"""
+    memes = get_memes_from_database(limit=max(1, count))
     if not memes:
         logger.error("❌ No memes available!")
+        return None
+    
+    return MediaPrefetch(memes)
+
+def cleanup_temp_file(temp_file):
+    """Remove a downloaded meme file"""
+    if temp_file and os.path.exists(temp_file):
+        os.unlink(temp_file)
+        logger.info("🧹 Temp file cleaned")
+
+def publish_meme(driver, meme, temp_file):
+    """Upload a downloaded meme with a logged-in driver and record it as posted"""
+    try:
+        # Upload
+        caption = format_caption(meme)
+        uploaded = upload_post(driver, temp_file, caption)
+        if uploaded:
+            # Mark as posted (it is live now, so it must never be claimed again)
+            record_published(meme['id'])
+            
+            logger.info("🎉 SUCCESS!")
+            logger.info(f"   Meme: {meme['title']}")
+            return True
+        
+        if uploaded is None:
+            # It may be live after all: keep the lease until it expires instead of re-queueing it now
+            logger.error(f"❌ Share of meme {meme['id']} unconfirmed; keeping its lease")
+            return False
+        
+        logger.error("❌ Upload failed")
+        release_memes([meme['id']])
         return False
     
-    meme = memes[0]
-    logger.info(f"🎯 Selected: {meme['title'][:50]}... (Score: {meme.get('score', 0)})")
+    except Exception as e:
+        logger.error(f"❌ Error: {e}")
+        release_memes([meme['id']])
+        return False
     
-    # Download meme
-    temp_file = download_meme_file(meme['url'], meme['id'])
-    if not temp_file:
-        logger.error("❌ Download failed")
+    finally:
+        cleanup_temp_file(temp_file)
+
+def main():
+    """Main function"""
+    logger.info("🚀 Starting Instagram uploader...")
+    logger.info("=" * 60)
+    
+    if not check_prerequisites():
         return False
     
-    # Setup driver
-    driver = setup_driver()
-    if not driver:
-        logger.error("❌ Chrome setup failed")
+    # Downloads run while Chrome starts and logs in
+    prefetch = start_prefetch()
+    if not prefetch:
         return False
     
+    driver = None
     success = False
     try:
+        # Setup driver
+        driver = setup_driver()
+        if not driver:
+            logger.error("❌ Chrome setup failed")
+            return False
+        
         # Login
-        if not instagram_login(driver, INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD):
+        if not ensure_logged_in(driver, INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD):
             logger.error("❌ Login failed")
             return False
         
-        # Upload
-        caption = format_caption(meme)
-        if upload_post(driver, temp_file, caption):
-            # Mark as posted
-            mark_meme_as_posted(meme['id'])
-            posted_ids.append(meme['id'])
-            state["posted_meme_ids"] = posted_ids
-            state["last_upload_date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            save_state(state)
-            
-            logger.info("🎉 SUCCESS!")
-            logger.info(f"   Meme: {meme['title']}")
-            success = True
-        else:
-            logger.error("❌ Upload failed")
-    
-    except Exception as e:
-        logger.error(f"❌ Error: {e}")
+        meme, temp_file = prefetch.next_ready()
+        if not meme:
+            logger.error("❌ Download failed")
+            return False
+        
+        success = publish_meme(driver, meme, temp_file)
     
     finally:
-        # Cleanup
-        if temp_file and os.path.exists(temp_file):
-            os.unlink(temp_file)
-            logger.info("🧹 Temp file cleaned")
-        
+        prefetch.close()
         if driver:
             driver.quit()
             logger.info("🔒 Driver closed")
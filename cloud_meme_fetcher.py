@@ -1,13 +1,21 @@
 import os
-import praw
+import sys
 import requests
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import tempfile
+from psycopg2.extras import RealDictCursor, execute_values
 import time
-import random
+import json
+import socket
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+from itertools import islice
 from datetime import datetime
+import db_pool
+import media_cache
+import meme_stats
+import migrate_db
+from image_hash import HashIndex, dhash, to_signed
 
 # Set up logging
 logging.basicConfig(
@@ -30,93 +38,315 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 SUBREDDIT = "dankmemes"
 IMAGES_TO_FETCH = 20
 VIDEOS_TO_FETCH = 5  # Reduced for free tier
+LISTING_TYPES = ('hot', 'new', 'rising', 'top')
+
+# JSON list of sources, e.g.
+# [{"subreddit": "dankmemes", "listing": "hot", "images": 20, "videos": 5, "limit": 200}]
+MEME_SOURCES = os.getenv("MEME_SOURCES")
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", 4))
+# Shared across all sources; Reddit allows 100 OAuth requests per minute
+REDDIT_REQUESTS_PER_MINUTE = float(os.getenv("REDDIT_REQUESTS_PER_MINUTE", 60))
+REDDIT_REQUEST_BURST = int(os.getenv("REDDIT_REQUEST_BURST", 5))
+
+# Incremental fetching: stop paging once we are back in content seen last run
+# A full scan every FULL_SCAN_EVERY scheduled fetches (FETCH_INTERVAL_HOURS apart, see
+# scheduler_main.py); half an interval of slack keeps fetch duration and start jitter
+# from pushing a due full scan to the following run
+FETCH_INTERVAL_HOURS = float(os.getenv("FETCH_INTERVAL_HOURS", 6))
+FULL_SCAN_EVERY = int(os.getenv("FULL_SCAN_EVERY", 4))
+FULL_SCAN_INTERVAL_HOURS = float(os.getenv("FULL_SCAN_INTERVAL_HOURS",
+                                           (FULL_SCAN_EVERY - 0.5) * FETCH_INTERVAL_HOURS))
+INCREMENTAL_PAGE_SIZE = int(os.getenv("INCREMENTAL_PAGE_SIZE", 25))
+INCREMENTAL_STOP_AFTER_SEEN = int(os.getenv("INCREMENTAL_STOP_AFTER_SEEN", 25))
+CURSOR_MAX_FULLNAMES = 500
+
+# Perceptual-hash near-duplicate rejection (images only)
+PHASH_DEDUP = os.getenv("PHASH_DEDUP", "true").lower() == "true"
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", 6))
+
+# Posting queue claims: a meme is leased to one worker until posted or expired
+WORKER_ID = os.getenv("UPLOADER_WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+CLAIM_LEASE_SECONDS = int(os.getenv("UPLOAD_LEASE_SECONDS", 900))
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", 100))
+LISTING_PAGE_SIZE = 100  # Matches Reddit's max listing page
+RECENT_IDS_CACHE_SIZE = int(os.getenv("RECENT_IDS_CACHE_SIZE", 5000))
+
+class RecentIdCache:
+    """Bounded LRU set of post ids already known to be in the database"""
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __contains__(self, post_id):
+        with self._lock:
+            if post_id in self._ids:
+                self._ids.move_to_end(post_id)
+                return True
+            return False
+    
+    def add_many(self, post_ids):
+        with self._lock:
+            for post_id in post_ids:
+                self._ids[post_id] = True
+                self._ids.move_to_end(post_id)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+recent_post_ids = RecentIdCache(RECENT_IDS_CACHE_SIZE)
+
+class RateBudget:
+    """Token bucket shared by every fetch worker to stay under one Reddit rate limit"""
+    
+    def __init__(self, per_minute, burst=1):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until one request may be made"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+phash_index = HashIndex()
+_phash_loaded_seq = 0
+_phash_lock = threading.Lock()
+# Re-read this many sequence numbers per refresh: a writer that took a lower
+# phash_seq can commit after a higher one we already loaded
+PHASH_SEQ_OVERLAP = 1000
+
+def refresh_phash_index(db):
+    """Load hashes written since the last refresh (new rows and backfills) into the in-process index"""
+    global _phash_loaded_seq
+    with _phash_lock:
+        for phash_seq, post_id, phash in db.get_phashes(max(0, _phash_loaded_seq - PHASH_SEQ_OVERLAP)):
+            phash_index.add(post_id, phash)
+            _phash_loaded_seq = max(_phash_loaded_seq, phash_seq)
+    return len(phash_index)
+
+def load_sources():
+    """Parse MEME_SOURCES, falling back to the single default subreddit"""
+    raw = [{"subreddit": SUBREDDIT}]
+    if MEME_SOURCES:
+        try:
+            raw = json.loads(MEME_SOURCES)
+        except ValueError as e:
+            logger.error(f"❌ Invalid MEME_SOURCES, using r/{SUBREDDIT}: {e}")
+    
+    sources = []
+    for entry in raw:
+        listing = entry.get("listing", "hot")
+        if listing not in LISTING_TYPES:
+            logger.warning(f"⚠️ Unknown listing '{listing}' for r/{entry.get('subreddit')}, using hot")
+            listing = "hot"
+        sources.append({
+            "subreddit": entry["subreddit"],
+            "listing": listing,
+            "images": int(entry.get("images", IMAGES_TO_FETCH)),
+            "videos": int(entry.get("videos", VIDEOS_TO_FETCH)),
+            "limit": int(entry.get("limit", 200)),
+        })
+    return sources
+
+# Hot queue queries; each has a matching partial index in migrate_db.py
+NEXT_MEME_CLAIM_SQL = """
+    WITH candidate AS (
+        SELECT id, claim_expires_at AS previous_expiry
+        FROM memes
+        WHERE posted = FALSE AND failed_attempts < 3
+        AND (claim_expires_at IS NULL OR claim_expires_at < NOW())
+        {type_filter}
+        ORDER BY score DESC, downloaded_at ASC
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE memes m
+    SET claimed_by = %s, claim_expires_at = NOW() + make_interval(secs => %s)
+    FROM candidate c
+    WHERE m.id = c.id
+    RETURNING m.*, c.previous_expiry IS NOT NULL AS reclaimed
+"""
+
+UNHASHED_IMAGES_SQL = """
+    SELECT id, post_id, url FROM memes
+    WHERE phash IS NULL AND file_type = 'image' AND url IS NOT NULL AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
 
 class MemeDatabase:
     def __init__(self, database_url):
         self.database_url = database_url
-        self.init_database()
+        # Cached version check - schema changes live in migrate_db.py
+        if not migrate_db.ensure_schema():
+            raise RuntimeError("Database schema is out of date - run migrate_db.py")
+    
+    def get_connection(self, cursor_factory=None):
+        return db_pool.get_connection(cursor_factory=cursor_factory, database_url=self.database_url)
+    
+    def add_memes(self, memes):
+        """Add many memes in one multi-row upsert; returns the post_ids that were new
+        
+        Each meme is a dict with post_id, title, url, file_type, file_size, subreddit, score.
+        Returns None when the batch could not be written, so callers can tell
+        "nothing new" apart from "nothing stored".
+        """
+        rows = {}
+        for meme in memes:
+            rows.setdefault(meme['post_id'], (
+                meme['post_id'], meme['title'][:500], meme['url'], meme['file_type'],
+                meme.get('file_size', 0), meme.get('subreddit', ''), meme.get('score', 0),
+                meme.get('phash')
+            ))
+        
+        if not rows:
+            return []
+        
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    inserted = execute_values(cur, """
+                        INSERT INTO memes (post_id, title, url, file_type, file_size, subreddit, score, phash)
+                        VALUES %s
+                        ON CONFLICT (post_id) DO NOTHING
+                        RETURNING post_id;
+                    """, list(rows.values()), page_size=len(rows), fetch=True)
+            
+            new_ids = {row[0] for row in inserted}
+            meme_stats.invalidate()
+            logger.info(f"✅ Added {len(new_ids)}/{len(rows)} memes in one batch")
+            return [post_id for post_id in rows if post_id in new_ids]
+        except Exception as e:
+            logger.error(f"❌ Failed to add meme batch: {e}")
+            return None
+    
+    def get_known_post_ids(self, post_ids):
+        """Return the subset of post_ids already stored, in one query"""
+        if not post_ids:
+            return set()
+        
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT post_id FROM memes WHERE post_id = ANY(%s)", (list(post_ids),))
+                    return {row[0] for row in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"❌ Failed to look up known posts: {e}")
+            return set()
+    
+    def get_phashes(self, after_seq=0):
+        """(phash_seq, post_id, phash) for every hash written after `after_seq`"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT phash_seq, post_id, phash FROM memes
+                        WHERE phash_seq > %s
+                        ORDER BY phash_seq
+                    """, (after_seq,))
+                    return cur.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Failed to load perceptual hashes: {e}")
+            return []
     
-    def get_connection(self):
-        return psycopg2.connect(self.database_url)
+    def get_unhashed_images(self, after_id=0, limit=200):
+        """Next batch of image rows without a perceptual hash"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(UNHASHED_IMAGES_SQL, (after_id, limit))
+                    return cur.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Failed to load unhashed memes: {e}")
+            return []
     
-    def init_database(self):
-        """Initialize database tables"""
+    def set_phashes(self, hashes):
+        """Store many (id, phash) pairs in one statement"""
+        if not hashes:
+            return
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
+                    execute_values(cur, """
+                        UPDATE memes AS m SET phash = v.phash
+                        FROM (VALUES %s) AS v(id, phash)
+                        WHERE m.id = v.id
+                    """, hashes, template="(%s, %s::bigint)", page_size=len(hashes))
+        except Exception as e:
+            logger.error(f"❌ Failed to store perceptual hashes: {e}")
+    
+    def get_fetch_cursor(self, subreddit, listing):
+        """Get the high-water mark left by the previous fetch of a listing"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
                     cur.execute("""
-                        CREATE TABLE IF NOT EXISTS memes (
-                            id SERIAL PRIMARY KEY,
-                            post_id VARCHAR(50) UNIQUE,
-                            title TEXT,
-                            url TEXT,
-                            file_type VARCHAR(10),
-                            file_size INTEGER DEFAULT 0,
-                            subreddit VARCHAR(50),
-                            score INTEGER DEFAULT 0,
-                            downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            posted BOOLEAN DEFAULT FALSE,
-                            post_date TIMESTAMP NULL,
-                            failed_attempts INTEGER DEFAULT 0
-                        );
-                        
-                        CREATE TABLE IF NOT EXISTS fetch_history (
-                            id SERIAL PRIMARY KEY,
-                            fetch_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            images_fetched INTEGER,
-                            videos_fetched INTEGER,
-                            total_processed INTEGER,
-                            errors TEXT
-                        );
-                        
-                        CREATE INDEX IF NOT EXISTS idx_memes_posted ON memes(posted);
-                        CREATE INDEX IF NOT EXISTS idx_memes_type ON memes(file_type);
-                    """)
-            logger.info("✅ Database initialized successfully")
+                        SELECT last_seen_fullnames, last_seen_utc, last_full_scan_at,
+                               (last_full_scan_at IS NULL OR
+                                last_full_scan_at <= CURRENT_TIMESTAMP - make_interval(secs => %s)) AS full_scan_due
+                        FROM fetch_cursors
+                        WHERE subreddit = %s AND listing = %s
+                    """, (FULL_SCAN_INTERVAL_HOURS * 3600, subreddit, listing))
+                    return cur.fetchone()
         except Exception as e:
-            logger.error(f"❌ Database initialization failed: {e}")
-            raise
+            logger.error(f"❌ Failed to load fetch cursor: {e}")
+            return None
     
-    def add_meme(self, post_id, title, url, file_type, file_size=0, subreddit='', score=0):
-        """Add meme to database"""
+    def save_fetch_cursor(self, subreddit, listing, fullnames, last_seen_utc, full_scan=False):
+        """Persist the newest fullnames/timestamp seen for a listing"""
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("""
-                        INSERT INTO memes (post_id, title, url, file_type, file_size, subreddit, score)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (post_id) DO NOTHING
-                        RETURNING id;
-                    """, (post_id, title[:500], url, file_type, file_size, subreddit, score))
-                    
-                    result = cur.fetchone()
-                    if result:
-                        logger.info(f"✅ Added meme: {post_id} - {title[:30]}...")
-                        return True
-                    return False  # Already exists
+                        INSERT INTO fetch_cursors
+                        (subreddit, listing, last_seen_fullnames, last_seen_utc, last_full_scan_at, updated_at)
+                        VALUES (%s, %s, %s, %s, CASE WHEN %s THEN CURRENT_TIMESTAMP END, CURRENT_TIMESTAMP)
+                        ON CONFLICT (subreddit, listing) DO UPDATE SET
+                            last_seen_fullnames = EXCLUDED.last_seen_fullnames,
+                            last_seen_utc = GREATEST(fetch_cursors.last_seen_utc, EXCLUDED.last_seen_utc),
+                            last_full_scan_at = COALESCE(EXCLUDED.last_full_scan_at, fetch_cursors.last_full_scan_at),
+                            updated_at = CURRENT_TIMESTAMP
+                    """, (subreddit, listing, list(fullnames), last_seen_utc, full_scan))
         except Exception as e:
-            logger.error(f"❌ Failed to add meme: {e}")
-            return False
+            logger.error(f"❌ Failed to save fetch cursor: {e}")
     
-    def get_next_meme(self, file_type=None):
-        """Get next unposted meme"""
+    def get_next_meme(self, file_type=None, worker_id=None, lease_seconds=None):
+        """Claim the next unposted meme for this worker
+        
+        The row is leased (claimed_by/claim_expires_at) in the same statement
+        that selects it, and rows another worker is claiming are skipped, so
+        concurrent posters never get the same meme. Expired leases are free
+        to be claimed again.
+        """
+        worker_id = worker_id or WORKER_ID
+        lease_seconds = lease_seconds or CLAIM_LEASE_SECONDS
         try:
             with self.get_connection() as conn:
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    query = """
-                        SELECT * FROM memes 
-                        WHERE posted = FALSE AND failed_attempts < 3
-                    """
-                    params = []
-                    
-                    if file_type:
-                        query += " AND file_type = %s"
-                        params.append(file_type)
-                    
-                    query += " ORDER BY score DESC, downloaded_at ASC LIMIT 1"
+                    type_filter = "AND file_type = %s" if file_type else ""
+                    params = [file_type] if file_type else []
                     
-                    cur.execute(query, params)
-                    return cur.fetchone()
+                    started = time.time()
+                    cur.execute(NEXT_MEME_CLAIM_SQL.format(type_filter=type_filter),
+                                params + [worker_id, lease_seconds])
+                    meme = cur.fetchone()
+                    elapsed_ms = (time.time() - started) * 1000
+            
+            if meme:
+                reclaimed = " (reclaimed expired lease)" if meme['reclaimed'] else ""
+                logger.info(f"🔒 Claimed {meme['post_id']} in {elapsed_ms:.1f} ms{reclaimed}")
+            return meme
         except Exception as e:
             logger.error(f"❌ Failed to get next meme: {e}")
             return None
@@ -128,9 +358,11 @@ class MemeDatabase:
                 with conn.cursor() as cur:
                     cur.execute("""
                         UPDATE memes 
-                        SET posted = TRUE, post_date = CURRENT_TIMESTAMP
+                        SET posted = TRUE, post_date = CURRENT_TIMESTAMP,
+                            claimed_by = NULL, claim_expires_at = NULL
                         WHERE post_id = %s
                     """, (post_id,))
+            meme_stats.invalidate()
             logger.info(f"✅ Marked as posted: {post_id}")
             return True
         except Exception as e:
@@ -144,56 +376,63 @@ class MemeDatabase:
                 with conn.cursor() as cur:
                     cur.execute("""
                         UPDATE memes 
-                        SET failed_attempts = failed_attempts + 1
+                        SET failed_attempts = failed_attempts + 1,
+                            claimed_by = NULL, claim_expires_at = NULL
                         WHERE post_id = %s
                     """, (post_id,))
+            meme_stats.invalidate()
             logger.info(f"⚠️ Marked as failed: {post_id}")
         except Exception as e:
             logger.error(f"❌ Failed to update failure count: {e}")
     
     def get_stats(self):
-        """Get current statistics"""
+        """Get current statistics (from the trigger-maintained counters, briefly cached)"""
         try:
-            with self.get_connection() as conn:
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    cur.execute("""
-                        SELECT 
-                            COUNT(*) as total_memes,
-                            SUM(CASE WHEN file_type = 'image' THEN 1 ELSE 0 END) as total_images,
-                            SUM(CASE WHEN file_type = 'video' THEN 1 ELSE 0 END) as total_videos,
-                            SUM(CASE WHEN posted = FALSE AND failed_attempts < 3 THEN 1 ELSE 0 END) as available,
-                            SUM(CASE WHEN posted = TRUE THEN 1 ELSE 0 END) as posted,
-                            MAX(downloaded_at) as last_fetch
-                        FROM memes;
-                    """)
-                    return cur.fetchone()
+            counters = meme_stats.get_counters(database_url=self.database_url)
+            return {
+                "total_memes": counters.get("total", 0),
+                "total_images": counters.get("images", 0),
+                "total_videos": counters.get("videos", 0),
+                "available": counters.get("available", 0),
+                "posted": counters.get("posted", 0),
+                "last_fetch": meme_stats.last_fetch(counters),
+            }
         except Exception as e:
             logger.error(f"❌ Failed to get stats: {e}")
             return {}
     
-    def log_fetch_session(self, images_fetched, videos_fetched, total_processed, errors=""):
-        """Log fetch session results"""
+    def log_fetch_session(self, images_fetched, videos_fetched, total_processed, errors="",
+                          subreddit=None, listing=None, skipped_known=0, elapsed_seconds=None):
+        """Log fetch session results (one row per source)"""
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("""
                         INSERT INTO fetch_history 
-                        (images_fetched, videos_fetched, total_processed, errors)
-                        VALUES (%s, %s, %s, %s)
-                    """, (images_fetched, videos_fetched, total_processed, errors))
+                        (images_fetched, videos_fetched, total_processed, errors,
+                         subreddit, listing, skipped_known, elapsed_seconds)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    """, (images_fetched, videos_fetched, total_processed, errors,
+                          subreddit, listing, skipped_known, elapsed_seconds))
         except Exception as e:
             logger.error(f"❌ Failed to log fetch session: {e}")
 
+def create_reddit_client():
+    """Create a Reddit client (PRAW clients are not shared between threads)"""
+    # praw is only needed once a fetch actually runs
+    import praw
+    return praw.Reddit(
+        client_id=CLIENT_ID,
+        client_secret=CLIENT_SECRET,
+        username=USERNAME,
+        password=PASSWORD,
+        user_agent=USER_AGENT
+    )
+
 def test_reddit_connection():
     """Test Reddit API connection"""
     try:
-        reddit = praw.Reddit(
-            client_id=CLIENT_ID,
-            client_secret=CLIENT_SECRET,
-            username=USERNAME,
-            password=PASSWORD,
-            user_agent=USER_AGENT
-        )
+        reddit = create_reddit_client()
         
         user = reddit.user.me()
         logger.info(f"✅ Reddit authentication successful: {user.name}")
@@ -226,6 +465,13 @@ def get_file_size(url):
 def download_meme_temporarily(url):
     """Download meme to temporary file"""
     try:
+        cache = media_cache.get_cache()
+        cached = cache.lookup(url)
+        if cached:
+            temp_file = cache.materialize(cached)
+            logger.info(f"✅ Cache hit: {os.path.basename(temp_file)}")
+            return temp_file
+        
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
@@ -242,26 +488,50 @@ def download_meme_temporarily(url):
         elif url.endswith('.mp4'):
             suffix = '.mp4'
         
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                temp_file.write(chunk)
-        
-        temp_file.close()
-        
-        # Verify file
-        if os.path.getsize(temp_file.name) < 1024:
-            os.unlink(temp_file.name)
+        # Verify file (files under 1 KB are not cached)
+        cached = cache.store(url, response.iter_content(chunk_size=8192), suffix, min_size=1024)
+        if not cached:
             return None
-            
-        logger.info(f"✅ Downloaded temporarily: {os.path.basename(temp_file.name)}")
-        return temp_file.name
+        
+        temp_file = cache.materialize(cached)
+        logger.info(f"✅ Downloaded temporarily: {os.path.basename(temp_file)}")
+        return temp_file
         
     except Exception as e:
         logger.error(f"❌ Download failed: {e}")
         return None
 
+def compute_phash(url):
+    """Download (through the media cache) and hash an image; returns (phash, file_size)"""
+    temp_file = download_meme_temporarily(url)
+    if not temp_file:
+        return None, None
+    try:
+        return dhash(temp_file), os.path.getsize(temp_file)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not hash {url}: {e}")
+        return None, None
+    finally:
+        cleanup_temp_file(temp_file)
+
+def annotate_known_posts(db, submissions, page_size=LISTING_PAGE_SIZE, rate_budget=None):
+    """Yield (submission, already_known) pairs, resolving each listing page in one lookup"""
+    submissions = iter(submissions)
+    while True:
+        # Pulling a page is one Reddit API request
+        if rate_budget:
+            rate_budget.acquire()
+        page = list(islice(submissions, page_size))
+        if not page:
+            return
+        
+        unresolved = [s.id for s in page if s.id not in recent_post_ids]
+        known = db.get_known_post_ids(unresolved)
+        recent_post_ids.add_many(known)
+        
+        for submission in page:
+            yield submission, submission.id in known or submission.id in recent_post_ids
+
 def cleanup_temp_file(filepath):
     """Clean up temporary file"""
     try:
@@ -271,90 +541,253 @@ def cleanup_temp_file(filepath):
     except Exception as e:
         logger.error(f"❌ Cleanup failed: {e}")
 
-def fetch_memes():
-    """Fetch memes and store in database"""
+def fetch_source(db, source, rate_budget):
+    """Fetch one subreddit listing into the database, respecting its quotas"""
     start_time = time.time()
-    logger.info(f"🚀 Starting database meme fetch from r/{SUBREDDIT}...")
-    
-    # Check environment
-    if not DATABASE_URL:
-        logger.error("❌ DATABASE_URL not found!")
-        return {"error": "Missing DATABASE_URL"}
-    
-    # Initialize database
-    try:
-        db = MemeDatabase(DATABASE_URL)
-    except Exception as e:
-        logger.error(f"❌ Database connection failed: {e}")
-        return {"error": str(e)}
-    
-    # Test Reddit connection
-    reddit = test_reddit_connection()
-    if not reddit:
-        return {"error": "Reddit connection failed"}
+    name = source['subreddit']
+    listing = source['listing']
+    images_wanted = source['images']
+    videos_wanted = source['videos']
     
     image_count = 0
     video_count = 0
     processed = 0
+    skipped_known = 0
+    skipped_duplicates = 0
     errors = []
+    pending = []
+    
+    # Decide between an incremental pass and a scheduled full scan
+    cursor = db.get_fetch_cursor(name, listing)
+    full_scan = not cursor or cursor['full_scan_due']
+    previous_list = list(cursor['last_seen_fullnames'] or []) if cursor else []
+    previous_fullnames = set(previous_list)
+    previous_utc = cursor['last_seen_utc'] if cursor else None
+    seen_fullnames = []
+    newest_utc = previous_utc
+    consecutive_seen = 0
+    stopped_early = False
+    
+    def flush_pending():
+        """Write the pending batch and count what was actually new"""
+        nonlocal image_count, video_count
+        if not pending:
+            return
+        
+        stored = db.add_memes(pending)
+        if stored is None:
+            # Nothing reached the database: forget the hashes reserved for this batch
+            for meme in pending:
+                if meme.get('phash') is not None:
+                    phash_index.remove(meme['post_id'])
+            pending.clear()
+            return
+        
+        # Every post in a stored batch is in the database now (new or conflict)
+        new_ids = set(stored)
+        recent_post_ids.add_many(meme['post_id'] for meme in pending)
+        for meme in pending:
+            if meme['post_id'] not in new_ids:
+                continue
+            if meme['file_type'] == 'image':
+                image_count += 1
+                logger.info(f"📸 r/{name} image {image_count}/{images_wanted} added")
+            else:
+                video_count += 1
+                logger.info(f"🎥 r/{name} video {video_count}/{videos_wanted} added")
+        pending.clear()
     
     try:
-        subreddit = reddit.subreddit(SUBREDDIT)
-        logger.info(f"📋 Fetching from r/{SUBREDDIT}...")
+        reddit = create_reddit_client()
+        subreddit = reddit.subreddit(name)
+        mode = "full scan" if full_scan else "incremental"
+        logger.info(f"📋 Fetching from r/{name} ({listing}, {mode})...")
         
-        for submission in subreddit.hot(limit=200):
+        submissions = getattr(subreddit, listing)(limit=source['limit'])
+        page_size = LISTING_PAGE_SIZE
+        if not full_scan and hasattr(submissions, 'params'):
+            # Smaller pages so we stop within a few posts of the high-water mark
+            page_size = INCREMENTAL_PAGE_SIZE
+            submissions.params['limit'] = page_size
+        
+        for submission, already_known in annotate_known_posts(db, submissions, page_size, rate_budget):
             processed += 1
+            seen_fullnames.append(submission.fullname)
+            created_utc = getattr(submission, 'created_utc', None)
+            if created_utc and (newest_utc is None or created_utc > newest_utc):
+                newest_utc = created_utc
+            
+            if not full_scan:
+                # 'new' is chronological; other listings stop after a run of seen posts
+                if listing == 'new' and previous_utc and created_utc and created_utc <= previous_utc:
+                    stopped_early = True
+                    break
+                
+                if already_known or submission.fullname in previous_fullnames:
+                    consecutive_seen += 1
+                else:
+                    consecutive_seen = 0
+                
+                if consecutive_seen >= INCREMENTAL_STOP_AFTER_SEEN:
+                    stopped_early = True
+                    break
             
             if submission.removed_by_category or not submission.title:
                 continue
             
+            # Seen in an earlier run - skip before any HEAD/download/insert
+            if already_known:
+                skipped_known += 1
+                continue
+            
             logger.info(f"🔍 Processing: {submission.title[:50]}...")
             
+            # Only queue as many candidates as could still fit the quotas,
+            # so a batch never pushes the counts past their targets
+            pending_images = sum(1 for m in pending if m['file_type'] == 'image')
+            pending_videos = len(pending) - pending_images
+            
             # Process images
-            if is_valid_image_url(submission.url) and image_count < IMAGES_TO_FETCH:
-                file_size = get_file_size(submission.url)
-                if db.add_meme(submission.id, submission.title, submission.url, 
-                              'image', file_size, SUBREDDIT, submission.score):
-                    image_count += 1
-                    logger.info(f"📸 Image {image_count}/{IMAGES_TO_FETCH} added")
+            if is_valid_image_url(submission.url) and image_count + pending_images < images_wanted:
+                phash, file_size = None, None
+                if PHASH_DEDUP:
+                    phash, file_size = compute_phash(submission.url)
+                    if phash is not None:
+                        duplicate = phash_index.add_if_unique(submission.id, phash, PHASH_MAX_DISTANCE)
+                        if duplicate:
+                            skipped_duplicates += 1
+                            logger.info(f"♊ Near-duplicate of {duplicate[0]} (distance {duplicate[1]}), skipping")
+                            continue
+                
+                pending.append({
+                    'post_id': submission.id,
+                    'title': submission.title,
+                    'url': submission.url,
+                    'file_type': 'image',
+                    'file_size': file_size if file_size is not None else get_file_size(submission.url),
+                    'subreddit': name,
+                    'score': submission.score,
+                    'phash': to_signed(phash) if phash is not None else None
+                })
             
             # Process videos  
-            elif is_valid_video_url(submission.url) and video_count < VIDEOS_TO_FETCH:
+            elif is_valid_video_url(submission.url) and video_count + pending_videos < videos_wanted:
                 video_url = submission.url
                 
                 # Handle Reddit videos
                 if hasattr(submission, 'media') and submission.media and "reddit_video" in submission.media:
                     video_url = submission.media["reddit_video"]["fallback_url"]
                 
-                file_size = get_file_size(video_url)
-                if db.add_meme(submission.id, submission.title, video_url,
-                              'video', file_size, SUBREDDIT, submission.score):
-                    video_count += 1
-                    logger.info(f"🎥 Video {video_count}/{VIDEOS_TO_FETCH} added")
+                pending.append({
+                    'post_id': submission.id,
+                    'title': submission.title,
+                    'url': video_url,
+                    'file_type': 'video',
+                    'file_size': get_file_size(video_url),
+                    'subreddit': name,
+                    'score': submission.score
+                })
+            
+            # Write once pending candidates could fill a quota (or the batch is large)
+            pending_images = sum(1 for m in pending if m['file_type'] == 'image')
+            pending_videos = len(pending) - pending_images
+            if (len(pending) >= INSERT_BATCH_SIZE or
+                    (pending_images and image_count + pending_images >= images_wanted) or
+                    (pending_videos and video_count + pending_videos >= videos_wanted)):
+                flush_pending()
             
             # Break if targets reached
-            if image_count >= IMAGES_TO_FETCH and video_count >= VIDEOS_TO_FETCH:
+            if image_count >= images_wanted and video_count >= videos_wanted:
                 break
-                
-            # Respectful delay
-            if processed % 10 == 0:
-                time.sleep(random.uniform(1, 2))
+        
+        flush_pending()
     
     except Exception as e:
-        error_msg = f"Fetch error: {str(e)}"
+        error_msg = f"Fetch error (r/{name}): {str(e)}"
         errors.append(error_msg)
         logger.error(f"❌ {error_msg}")
+        flush_pending()
     
-    # Log session
-    db.log_fetch_session(image_count, video_count, processed, "; ".join(errors))
+    if stopped_early:
+        logger.info(f"⏹️ r/{name} reached previously seen content after {processed} posts")
+    
+    # Newest first, then whatever we remembered from earlier runs
+    fullnames = list(dict.fromkeys(seen_fullnames + previous_list))
+    db.save_fetch_cursor(name, listing, fullnames[:CURSOR_MAX_FULLNAMES], newest_utc,
+                         full_scan=full_scan and not errors)
+    
+    elapsed_time = time.time() - start_time
+    db.log_fetch_session(image_count, video_count, processed, "; ".join(errors),
+                         subreddit=name, listing=listing, skipped_known=skipped_known,
+                         elapsed_seconds=elapsed_time)
+    
+    return {
+        "subreddit": name,
+        "listing": listing,
+        "images_fetched": image_count,
+        "videos_fetched": video_count,
+        "total_processed": processed,
+        "skipped_known": skipped_known,
+        "skipped_duplicates": skipped_duplicates,
+        "full_scan": full_scan,
+        "stopped_early": stopped_early,
+        "time_elapsed": elapsed_time,
+        "errors": errors
+    }
+
+def fetch_memes():
+    """Fetch memes from every configured source concurrently and store in database"""
+    start_time = time.time()
+    sources = load_sources()
+    names = ", ".join(f"r/{source['subreddit']}" for source in sources)
+    logger.info(f"🚀 Starting database meme fetch from {names}...")
+    
+    # Check environment
+    if not DATABASE_URL:
+        logger.error("❌ DATABASE_URL not found!")
+        return {"error": "Missing DATABASE_URL"}
+    
+    # Initialize database
+    try:
+        db = MemeDatabase(DATABASE_URL)
+    except Exception as e:
+        logger.error(f"❌ Database connection failed: {e}")
+        return {"error": str(e)}
+    
+    # Test Reddit connection
+    reddit = test_reddit_connection()
+    if not reddit:
+        return {"error": "Reddit connection failed"}
+    
+    if PHASH_DEDUP:
+        logger.info(f"🧬 {refresh_phash_index(db)} perceptual hashes indexed")
+    
+    rate_budget = RateBudget(REDDIT_REQUESTS_PER_MINUTE, REDDIT_REQUEST_BURST)
+    results = []
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_CONCURRENCY, len(sources)))) as executor:
+        futures = [executor.submit(fetch_source, db, source, rate_budget) for source in sources]
+        for future in as_completed(futures):
+            results.append(future.result())
+    
+    image_count = sum(r['images_fetched'] for r in results)
+    video_count = sum(r['videos_fetched'] for r in results)
+    processed = sum(r['total_processed'] for r in results)
+    skipped_known = sum(r['skipped_known'] for r in results)
+    skipped_duplicates = sum(r['skipped_duplicates'] for r in results)
     
     # Final stats
     elapsed_time = time.time() - start_time
     stats = db.get_stats()
     
     logger.info(f"\n🎯 Fetch Complete!")
+    for r in results:
+        logger.info(f"   r/{r['subreddit']} ({r['listing']}): {r['images_fetched']} images, "
+                    f"{r['videos_fetched']} videos, {r['skipped_known']} known, {r['time_elapsed']:.2f}s")
     logger.info(f"📸 Images added: {image_count}")
     logger.info(f"🎥 Videos added: {video_count}")
+    logger.info(f"⏭️ Already known (skipped): {skipped_known}")
+    logger.info(f"♊ Near-duplicates (skipped): {skipped_duplicates}")
     logger.info(f"📊 Total available: {stats.get('available', 0)}")
     logger.info(f"⏱️ Time: {elapsed_time:.2f}s")
     
@@ -362,17 +795,64 @@ def fetch_memes():
         "images_fetched": image_count,
         "videos_fetched": video_count,
         "total_processed": processed,
+        "skipped_known": skipped_known,
+        "skipped_duplicates": skipped_duplicates,
         "time_elapsed": elapsed_time,
+        "sources": results,
         "stats": dict(stats) if stats else {}
     }
 
+def backfill_perceptual_hashes(batch_size=200, workers=4):
+    """Compute and store perceptual hashes for existing image rows"""
+    if not DATABASE_URL:
+        logger.error("❌ DATABASE_URL not found!")
+        return {"error": "Missing DATABASE_URL"}
+    
+    db = MemeDatabase(DATABASE_URL)
+    hashed = 0
+    failed = 0
+    last_id = 0
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            rows = db.get_unhashed_images(last_id, batch_size)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            
+            results = executor.map(lambda row: compute_phash(row[2])[0], rows)
+            hashes = []
+            for (row_id, post_id, _), phash in zip(rows, results):
+                if phash is None:
+                    failed += 1
+                    continue
+                hashes.append((row_id, to_signed(phash)))
+                phash_index.add(post_id, phash)
+            
+            db.set_phashes(hashes)
+            hashed += len(hashes)
+            logger.info(f"🧬 Backfilled {hashed} hashes ({failed} failed) up to id {last_id}")
+    
+    return {"hashed": hashed, "failed": failed}
+
+_database = None
+_database_lock = threading.Lock()
+
+def get_database():
+    """Shared MemeDatabase for the module-level helpers"""
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = MemeDatabase(DATABASE_URL)
+    return _database
+
 def get_meme_for_posting(prefer_images=True):
     """Get next meme for posting to Instagram"""
     if not DATABASE_URL:
         logger.error("❌ DATABASE_URL not found!")
         return None, None
     
-    db = MemeDatabase(DATABASE_URL)
+    db = get_database()
     
     # Try to get preferred type first
     file_type = 'image' if prefer_images else 'video'
@@ -404,8 +884,7 @@ def mark_meme_as_posted(post_id):
     if not DATABASE_URL:
         return False
     
-    db = MemeDatabase(DATABASE_URL)
-    return db.mark_as_posted(post_id)
+    return get_database().mark_as_posted(post_id)
 
 def get_meme_stats():
     """Get current meme statistics"""
@@ -413,13 +892,16 @@ def get_meme_stats():
         return {}
     
     try:
-        db = MemeDatabase(DATABASE_URL)
-        return dict(db.get_stats())
+        return dict(get_database().get_stats())
     except:
         return {}
 
 # Test function
 if __name__ == "__main__":
+    if "--backfill-hashes" in sys.argv:
+        print(f"Result: {backfill_perceptual_hashes()}")
+        sys.exit(0)
+    
     print("🧪 Testing database connection...")
     result = fetch_memes()
     print(f"Result: {result}")
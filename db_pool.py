@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Shared PostgreSQL connection pool for the Instagram Meme Bot
+Used by the fetcher, the uploader and the GraphQL API so every
+database call reuses a warm connection instead of reconnecting.
+"""
+
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Connections idle for longer than this get a "SELECT 1" before being handed out
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER", 30))
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free in time"""
+
+
+class DatabasePool:
+    """Thread-safe, bounded pool of psycopg2 connections"""
+
+    def __init__(self, database_url, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, healthcheck_after=DB_POOL_HEALTHCHECK_AFTER):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.database_url = database_url
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []          # [(connection, last_used_monotonic)]
+        self._in_use = set()
+        self._closed = False
+
+        self._metrics = {
+            "checkouts": 0,
+            "connections_opened": 0,
+            "connections_discarded": 0,
+            "healthcheck_failures": 0,
+            "timeouts": 0,
+            "total_wait_time": 0.0,
+            "max_wait_time": 0.0,
+        }
+
+        for _ in range(self.min_size):
+            self._idle.append((self._open(), time.monotonic()))
+
+    def _open(self):
+        conn = psycopg2.connect(self.database_url)
+        with self._lock:
+            self._metrics["connections_opened"] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._metrics["connections_discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_for):
+        """Cheap checks always, a round trip only for long-idle connections"""
+        if conn.closed:
+            return False
+
+        status = conn.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+
+        if idle_for < self.healthcheck_after:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Pooled connection failed health check: {e}")
+            with self._lock:
+                self._metrics["healthcheck_failures"] += 1
+            return False
+
+    def getconn(self):
+        """Check a connection out of the pool (blocks up to `timeout` seconds)"""
+        if self._closed:
+            raise PoolTimeoutError("Connection pool is closed")
+
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._metrics["timeouts"] += 1
+            raise PoolTimeoutError(
+                f"No database connection available after {self.timeout}s "
+                f"({self.max_size} in use)"
+            )
+        waited = time.monotonic() - started
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    candidate = self._idle.pop() if self._idle else None
+
+                if candidate is None:
+                    conn = self._open()
+                    break
+
+                candidate_conn, last_used = candidate
+                if self._is_healthy(candidate_conn, time.monotonic() - last_used):
+                    conn = candidate_conn
+                else:
+                    self._discard(candidate_conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use.add(conn)
+            self._metrics["checkouts"] += 1
+            self._metrics["total_wait_time"] += waited
+            self._metrics["max_wait_time"] = max(self._metrics["max_wait_time"], waited)
+
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool"""
+        with self._lock:
+            if conn not in self._in_use:
+                return
+            self._in_use.discard(conn)
+
+        try:
+            if discard or self._closed or conn.closed:
+                self._discard(conn)
+                return
+
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.cursor_factory = None
+            except Exception:
+                self._discard(conn)
+                return
+
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, cursor_factory=None):
+        """Borrow a connection; commits on success, rolls back on error"""
+        conn = self.getconn()
+        conn.cursor_factory = cursor_factory
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken or conn.closed)
+
+    def stats(self):
+        """Snapshot of pool usage"""
+        with self._lock:
+            checkouts = self._metrics["checkouts"]
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "avg_wait_time": self._metrics["total_wait_time"] / checkouts if checkouts else 0.0,
+                **self._metrics,
+            }
+
+    def close(self):
+        """Close every idle connection; in-use ones close when returned"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(database_url=None):
+    """Get the process-wide pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                url = database_url or DATABASE_URL
+                if not url:
+                    raise RuntimeError("DATABASE_URL not found!")
+                _pool = DatabasePool(url)
+                logger.info(f"✅ Database pool ready (min={_pool.min_size}, max={_pool.max_size})")
+    return _pool
+
+
+@contextmanager
+def get_connection(cursor_factory=None, database_url=None):
+    """Borrow a pooled connection for the duration of a `with` block"""
+    with get_pool(database_url).connection(cursor_factory=cursor_factory) as conn:
+        yield conn
+
+
+def pool_stats():
+    """Pool metrics, or an empty dict if the pool was never used"""
+    return _pool.stats() if _pool is not None else {}
+
+
+def close_pool():
+    """Close the process-wide pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
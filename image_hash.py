@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Perceptual hashing for near-duplicate meme detection
+dHash computed with Pillow, plus a multi-index hash table that finds every
+stored hash within a small Hamming distance without scanning them all.
+"""
+
+import threading
+from itertools import combinations
+from PIL import Image
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def dhash(image_path, hash_size=8):
+    """64-bit difference hash of an image file (robust to resizing and re-encoding)"""
+    with Image.open(image_path) as img:
+        img = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = list(img.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def to_signed(value):
+    """Unsigned 64-bit hash -> value that fits a Postgres BIGINT"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    """BIGINT from Postgres -> unsigned 64-bit hash"""
+    return value & ((1 << 64) - 1)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _chunk_neighbours(chunk, radius):
+    """Every CHUNK_BITS-bit value within `radius` bit flips of `chunk`"""
+    yield chunk
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), distance):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+
+class HashIndex:
+    """Multi-index hashing over 4 x 16-bit chunks
+
+    Two hashes within distance r must agree to within r // 4 bits on at
+    least one chunk, so a query only probes a handful of small buckets.
+    """
+
+    def __init__(self):
+        self._tables = [{} for _ in range(CHUNKS)]
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self._add_lock = threading.Lock()  # makes check-then-add atomic
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, key):
+        return key in self._hashes
+
+    @staticmethod
+    def _chunks(value):
+        return [(value >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def add(self, key, value):
+        value = to_unsigned(value)
+        with self._lock:
+            if key in self._hashes:
+                return
+            self._hashes[key] = value
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                table.setdefault(chunk, []).append(key)
+
+    def remove(self, key):
+        with self._lock:
+            value = self._hashes.pop(key, None)
+            if value is None:
+                return
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                bucket = table.get(chunk, [])
+                if key in bucket:
+                    bucket.remove(key)
+
+    def add_if_unique(self, key, value, max_distance):
+        """Add unless a stored hash is within `max_distance`; returns that (key, distance) match or None"""
+        with self._add_lock:
+            match = self.nearest(value, max_distance)
+            if match is None:
+                self.add(key, value)
+            return match
+
+    def query(self, value, max_distance):
+        """All (key, distance) pairs within `max_distance`, closest first"""
+        value = to_unsigned(value)
+        radius = max_distance // CHUNKS
+        matches = {}
+        with self._lock:
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                for probe in _chunk_neighbours(chunk, radius):
+                    for key in table.get(probe, ()):
+                        if key in matches:
+                            continue
+                        distance = hamming(value, self._hashes[key])
+                        if distance <= max_distance:
+                            matches[key] = distance
+        return sorted(matches.items(), key=lambda item: item[1])
+
+    def nearest(self, value, max_distance):
+        """Closest (key, distance) within `max_distance`, or None"""
+        matches = self.query(value, max_distance)
+        return matches[0] if matches else None
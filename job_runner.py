@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+In-process job runner for the scheduler
+Runs scheduled jobs as plain function calls on a thread pool (one worker per
+job) instead of forking a fresh interpreter per run. Every job gets overlap protection, a
+timeout, start jitter and a history of run durations; jobs named in
+SCHEDULER_ISOLATE (or registered as isolated) run as a subprocess instead.
+"""
+
+import os
+import time
+import random
+import threading
+import subprocess
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+SCHEDULER_JITTER_SECONDS = float(os.getenv("SCHEDULER_JITTER_SECONDS", 60))
+SCHEDULER_HISTORY = int(os.getenv("SCHEDULER_HISTORY", 20))
+# Comma separated job names to run in a subprocess, e.g. "fetch"
+SCHEDULER_ISOLATE = {name.strip() for name in os.getenv("SCHEDULER_ISOLATE", "").split(",") if name.strip()}
+
+
+class ScheduledJob:
+    """A named job, its limits and its recent runs"""
+
+    def __init__(self, name, func, timeout, command=None, jitter=SCHEDULER_JITTER_SECONDS, isolate=None):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.command = command
+        self.jitter = jitter
+        self.isolate = command is not None and (name in SCHEDULER_ISOLATE if isolate is None else isolate)
+        self.running = False
+        self.started_at = None
+        self.timed_out = False
+        self.skipped = 0
+        self.history = deque(maxlen=SCHEDULER_HISTORY)
+        self._lock = threading.Lock()
+        # Set whenever no run is pending or in progress
+        self._idle = threading.Event()
+        self._idle.set()
+
+    def stats(self):
+        durations = [run["duration"] for run in self.history]
+        return {
+            "running": self.running,
+            "started_at": self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.running and self.started_at else None,
+            "isolated": self.isolate,
+            "timeout": self.timeout,
+            "runs": len(self.history),
+            "skipped": self.skipped,
+            "avg_duration": sum(durations) / len(durations) if durations else 0.0,
+            "max_duration": max(durations, default=0.0),
+            "last_run": self.history[-1] if self.history else None,
+            "history": list(self.history),
+        }
+
+
+class JobRunner:
+    """Thread pool that runs registered jobs, one run per job at a time
+
+    The pool has one worker per registered job, so a long run never delays
+    another job, and start jitter waits on a timer rather than a worker.
+    A timed-out in-process run cannot be interrupted; it is reported as
+    timed out and further runs of that job are skipped until it returns.
+    Isolated runs are killed at their timeout.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.jobs = {}
+        # Called as callback(job, run) after every run
+        self.on_finish = []
+
+    def register(self, name, func, timeout, command=None, **options):
+        """Add a job; `command` is the argv used when the job runs isolated"""
+        job = ScheduledJob(name, func, timeout, command=command, **options)
+        self.jobs[name] = job
+        # Runs already submitted finish on the old pool
+        old_executor = self.executor
+        self.executor = ThreadPoolExecutor(max_workers=len(self.jobs), thread_name_prefix="scheduler-job")
+        if old_executor is not None:
+            old_executor.shutdown(wait=False)
+        mode = "subprocess" if job.isolate else "in-process"
+        logger.info(f"🗓️ Registered {name} job ({mode}, timeout {timeout:.0f}s, jitter {job.jitter:.0f}s)")
+        return job
+
+    def trigger(self, name, jitter=True):
+        """Start a run unless the previous one is still going; returns False if skipped"""
+        job = self.jobs[name]
+        with job._lock:
+            if job.running:
+                job.skipped += 1
+                since = job.started_at.strftime('%H:%M:%S') if job.started_at else "start"
+                logger.warning(f"⏭️ {name} still running since {since}, skipping this run")
+                return False
+            job.running = True
+            job.started_at = None
+            job.timed_out = False
+            job._idle.clear()
+
+        delay = random.uniform(0, job.jitter) if jitter and job.jitter > 0 else 0.0
+        if delay:
+            logger.info(f"🎲 {name} starting in {delay:.0f}s")
+            timer = threading.Timer(delay, self._submit, args=(job,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._submit(job)
+        return True
+
+    def _submit(self, job):
+        self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        job.started_at = datetime.now()
+        watchdog = threading.Timer(job.timeout, self._timed_out, args=(job,))
+        watchdog.daemon = True
+        watchdog.start()
+        started = time.perf_counter()
+        try:
+            if job.isolate:
+                success, message = self._run_isolated(job)
+            else:
+                success, message = job.func()
+        except Exception as e:
+            success, message = False, f"{type(e).__name__}: {e}"
+        finally:
+            watchdog.cancel()
+
+        run = {
+            "started_at": job.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            "duration": round(time.perf_counter() - started, 2),
+            "success": bool(success),
+            "timed_out": job.timed_out,
+            "isolated": job.isolate,
+            "message": message,
+        }
+        job.history.append(run)
+
+        for callback in self.on_finish:
+            try:
+                callback(job, run)
+            except Exception as e:
+                logger.error(f"❌ {job.name} finish callback failed: {e}")
+
+        # Together under the lock, so a trigger() can't start a run whose idle
+        # event this finishing run then sets
+        with job._lock:
+            job.running = False
+            job._idle.set()
+
+    def wait(self, name, timeout=None):
+        """Block until the job's current run (if any) is done; returns its run record, None on timeout"""
+        job = self.jobs[name]
+        if not job._idle.wait(timeout):
+            return None
+        return job.history[-1] if job.history else None
+
+    def _timed_out(self, job):
+        job.timed_out = True
+        if job.isolate:
+            return
+        logger.error(f"⏳ {job.name} exceeded its {job.timeout:.0f}s timeout; "
+                     f"skipping further runs until it returns")
+
+    def _run_isolated(self, job):
+        try:
+            result = subprocess.run(job.command, capture_output=True, text=True, timeout=job.timeout)
+        except subprocess.TimeoutExpired:
+            return False, f"Killed after {job.timeout:.0f}s"
+        output = (result.stdout + result.stderr).strip()[-500:]
+        return result.returncode == 0, f"Exit code {result.returncode}: {output}"
+
+    def stats(self):
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """Process-wide job runner; the scheduler registers its jobs on it"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+    return _runner
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Content-addressed local media cache
+Shared by the fetcher and the uploader so every asset is pulled from the
+CDN once. Files are stored by SHA-256 of their bytes, URLs map onto those
+files, writes are atomic and the total size is capped with LRU eviction,
+which only runs once a running byte total goes over budget.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "meme_cache"))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+# Unfinished downloads (.part/.progress) untouched for this long are abandoned
+MEDIA_CACHE_PARTIAL_MAX_AGE = int(os.getenv("MEDIA_CACHE_PARTIAL_MAX_AGE", 24 * 3600))
+
+
+class MediaCache:
+    """On-disk cache: objects/<sha256><ext> plus urls/<sha256(url)> -> object"""
+
+    def __init__(self, root=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, "objects")
+        self.urls_dir = os.path.join(root, "urls")
+        self.tmp_dir = os.path.join(root, "tmp")
+        for path in (self.objects_dir, self.urls_dir, self.tmp_dir):
+            os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_stored = 0
+        self.partials_pruned = 0
+        self._pruned_at = 0.0
+        self.total_bytes = self._scan_total()
+        self.prune_partials()
+
+    def _url_entry(self, url):
+        return os.path.join(self.urls_dir, hashlib.sha256(url.encode()).hexdigest())
+
+    def _write_atomic(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def lookup(self, url):
+        """Path of the cached copy of `url`, or None"""
+        entry = self._url_entry(url)
+        try:
+            with open(entry, 'r') as f:
+                object_name = f.read().strip()
+            path = os.path.join(self.objects_dir, object_name)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            # The object was evicted (possibly by another process) - drop the dangling entry
+            if os.path.exists(entry):
+                self._unlink_quietly(entry)
+            with self._lock:
+                self.misses += 1
+            return None
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def store(self, url, chunks, suffix, min_size=0):
+        """Stream `chunks` into the cache under `url`; returns the cached path or None if too small"""
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix=suffix)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        size += len(chunk)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        return self._commit(url, tmp_path, hasher.hexdigest(), size, suffix, min_size)
+
+    def store_file(self, url, file_path, suffix, min_size=0):
+        """Move an already-downloaded file (on the cache's filesystem) into the cache"""
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        return self._commit(url, file_path, hasher.hexdigest(), os.path.getsize(file_path), suffix, min_size)
+
+    def partial_path(self, url):
+        """Stable scratch path for resumable downloads of `url`"""
+        self.prune_partials()
+        return os.path.join(self.tmp_dir, hashlib.sha256(url.encode()).hexdigest() + ".part")
+
+    def _commit(self, url, tmp_path, digest, size, suffix, min_size):
+        if size < min_size:
+            os.unlink(tmp_path)
+            return None
+
+        object_name = digest + suffix
+        path = os.path.join(self.objects_dir, object_name)
+        if os.path.exists(path):
+            # Same bytes under another URL - keep one copy
+            os.unlink(tmp_path)
+            os.utime(path)
+        else:
+            os.replace(tmp_path, path)
+            with self._lock:
+                self.bytes_stored += size
+                self.total_bytes += size
+
+        self._write_atomic(self._url_entry(url), object_name)
+        if self.total_bytes > self.max_bytes:
+            self._evict(keep=path)
+        return path
+
+    def materialize(self, cached_path, prefix="meme_"):
+        """Private copy of a cached file that the caller may delete (hard link when possible)"""
+        suffix = os.path.splitext(cached_path)[1]
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix)
+        os.close(fd)
+        os.unlink(path)
+        try:
+            os.link(cached_path, path)
+        except OSError:
+            shutil.copyfile(cached_path, path)
+        return path
+
+    def _scan_total(self):
+        total = 0
+        for name in os.listdir(self.objects_dir):
+            try:
+                total += os.stat(os.path.join(self.objects_dir, name)).st_size
+            except OSError:
+                continue
+        return total
+
+    def _unlink_quietly(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _evict(self, keep=None):
+        """Drop least recently used objects until under the byte budget
+
+        The running total drifts when another process shares the cache
+        directory, so it is resynced from disk here.
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.objects_dir):
+                path = os.path.join(self.objects_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+
+            evicted = set()
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path = os.path.join(self.objects_dir, name)
+                if path == keep:
+                    continue
+                try:
+                    os.unlink(path)
+                    total -= size
+                    evicted.add(name)
+                    self.evictions += 1
+                except OSError:
+                    pass
+            self.total_bytes = total
+
+        if evicted:
+            self._prune_url_entries(evicted)
+
+    def _prune_url_entries(self, object_names):
+        """Remove urls/ entries pointing at any of `object_names`"""
+        for name in os.listdir(self.urls_dir):
+            entry = os.path.join(self.urls_dir, name)
+            try:
+                with open(entry, 'r') as f:
+                    target = f.read().strip()
+            except OSError:
+                continue
+            if target in object_names:
+                self._unlink_quietly(entry)
+
+    def prune_partials(self, max_age=MEDIA_CACHE_PARTIAL_MAX_AGE):
+        """Delete scratch files in tmp/ not written for `max_age` seconds (at most hourly)"""
+        now = time.time()
+        with self._lock:
+            if now - self._pruned_at < min(max_age, 3600):
+                return
+            self._pruned_at = now
+
+        pruned = 0
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                if now - os.stat(path).st_mtime > max_age:
+                    os.unlink(path)
+                    pruned += 1
+            except OSError:
+                continue
+        if pruned:
+            with self._lock:
+                self.partials_pruned += pruned
+            logger.info(f"🧹 Removed {pruned} abandoned partial download file(s)")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "partials_pruned": self.partials_pruned,
+                "bytes_stored": self.bytes_stored,
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Get the process-wide media cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MediaCache()
+    return _cache
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Pre-upload media normalization
+Resizes images to Instagram's feed dimensions, pads or crops them into a
+supported aspect ratio and re-encodes them as optimized JPEG. Results are
+cached by the source file's hash so each asset is only processed once.
+"""
+
+import io
+import os
+import math
+import hashlib
+import logging
+from PIL import Image, ImageOps
+import media_cache
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+INSTAGRAM_MAX_WIDTH = int(os.getenv("INSTAGRAM_MAX_WIDTH", 1080))
+# Instagram feed posts accept 4:5 (portrait) up to 1.91:1 (landscape)
+MIN_ASPECT_RATIO = 4 / 5
+MAX_ASPECT_RATIO = 1.91
+NORMALIZE_MODE = os.getenv("NORMALIZE_MODE", "pad")  # "pad" keeps all content, "crop" fills the frame
+NORMALIZE_JPEG_QUALITY = int(os.getenv("NORMALIZE_JPEG_QUALITY", 85))
+PAD_COLOR = (255, 255, 255)
+
+# Part of the cache key, so changing any setting re-renders
+SETTINGS_KEY = f"{INSTAGRAM_MAX_WIDTH}:{NORMALIZE_MODE}:{NORMALIZE_JPEG_QUALITY}"
+
+
+def file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def flatten(img):
+    """RGB image with any transparency composited onto the pad colour"""
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, PAD_COLOR)
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    return img.convert('RGB')
+
+
+def fit_aspect_ratio(img, mode=NORMALIZE_MODE):
+    """Pad or centre-crop into Instagram's supported aspect range"""
+    width, height = img.size
+    ratio = width / height
+
+    if ratio < MIN_ASPECT_RATIO:
+        if mode == 'crop':
+            new_height = int(width / MIN_ASPECT_RATIO)
+            top = (height - new_height) // 2
+            return img.crop((0, top, width, top + new_height))
+        target = (math.ceil(height * MIN_ASPECT_RATIO), height)
+    elif ratio > MAX_ASPECT_RATIO:
+        if mode == 'crop':
+            new_width = int(height * MAX_ASPECT_RATIO)
+            left = (width - new_width) // 2
+            return img.crop((left, 0, left + new_width, height))
+        target = (width, math.ceil(width / MAX_ASPECT_RATIO))
+    else:
+        return img
+
+    canvas = Image.new('RGB', target, PAD_COLOR)
+    canvas.paste(img, ((target[0] - width) // 2, (target[1] - height) // 2))
+    return canvas
+
+
+def needs_normalization(path):
+    """False for JPEGs that already fit Instagram's size and aspect limits"""
+    with Image.open(path) as img:
+        if img.format != 'JPEG' or img.mode != 'RGB':
+            return True
+        width, height = img.size
+    return width > INSTAGRAM_MAX_WIDTH or not MIN_ASPECT_RATIO <= width / height <= MAX_ASPECT_RATIO
+
+
+def render_jpeg(path):
+    """Normalized JPEG bytes for an image file"""
+    with Image.open(path) as img:
+        img.seek(0)  # first frame of animated GIFs
+        img = fit_aspect_ratio(flatten(img))
+
+    if img.width > INSTAGRAM_MAX_WIDTH:
+        height = round(img.height * INSTAGRAM_MAX_WIDTH / img.width)
+        img = img.resize((INSTAGRAM_MAX_WIDTH, height), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=NORMALIZE_JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def normalize_for_instagram(path, file_type=None, prefix="meme_"):
+    """Return a normalized copy of an image (videos and failures return `path` unchanged)"""
+    if file_type == 'video' or path.lower().endswith('.mp4'):
+        return path
+
+    try:
+        if not needs_normalization(path):
+            return path
+
+        cache = media_cache.get_cache()
+        key = f"normalized:{file_digest(path)}:{SETTINGS_KEY}"
+        cached = cache.lookup(key)
+        if not cached:
+            cached = cache.store(key, [render_jpeg(path)], '.jpg')
+
+        normalized = cache.materialize(cached, prefix=prefix)
+        logger.info(f"🗜️ Normalized {os.path.basename(path)}: "
+                    f"{os.path.getsize(path):,} -> {os.path.getsize(normalized):,} bytes")
+        return normalized
+    except Exception as e:
+        logger.warning(f"⚠️ Normalization failed, uploading original: {e}")
+        return path
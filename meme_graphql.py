@@ -5,49 +5,152 @@ Keeps your existing scraper untouched!
 """
 
 import os
-import subprocess
-import sys
+import time
+import base64
+import asyncio
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Optional
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import AsyncGenerator, List, Optional
 import strawberry
 from strawberry.fastapi import GraphQLRouter
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import async_db
+import background_jobs
+import db_pool
+import meme_stats
+import migrate_db
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Simple database helper
-def get_memes_from_db(uploaded_only=False, limit=20):
-    """Get memes from your existing database"""
-    try:
-        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT id, post_id, title, url, file_type, score,
-               COALESCE(uploaded_to_instagram, FALSE) as uploaded,
-               uploaded_at::text as uploaded_at
-        FROM memes 
-        WHERE url IS NOT NULL
-        """
-        
-        if uploaded_only is not None:
-            query += f" AND COALESCE(uploaded_to_instagram, FALSE) = {uploaded_only}"
-            
-        query += f" ORDER BY score DESC LIMIT {limit}"
-        
-        cursor.execute(query)
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
+GRAPHQL_MAX_PAGE_SIZE = int(os.getenv("GRAPHQL_MAX_PAGE_SIZE", 100))
+GRAPHQL_CACHE_TTL = float(os.getenv("GRAPHQL_CACHE_TTL", 30))
+GRAPHQL_CACHE_SIZE = int(os.getenv("GRAPHQL_CACHE_SIZE", 256))
+GRAPHQL_LISTEN_RETRY_MAX = float(os.getenv("GRAPHQL_LISTEN_RETRY_MAX", 60))
+
+class ResponseCache:
+    """Bounded TTL cache of resolver results, keyed by resolver and arguments
+
+    Every change to memes clears it: the database NOTIFYs on each visible change (so
+    the fetcher and uploader count even from other processes) and finished
+    fetch/upload jobs clear it too. The TTL only bounds staleness while the
+    listener is down. Failed loads are never cached.
+    """
+    
+    def __init__(self, ttl=GRAPHQL_CACHE_TTL, max_size=GRAPHQL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.listening = False
+    
+    async def get_or_load(self, key, loader):
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
         
-        return [dict(row) for row in results]
+        self.misses += 1
+        generation = self.generation
+        value = await loader()
+        # Don't store a result that was read before an invalidation landed
+        if generation == self.generation and self.ttl > 0:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+    
+    def invalidate(self):
+        self.generation += 1
+        self.invalidations += 1
+        self.entries.clear()
+        meme_stats.invalidate()
+
+response_cache = ResponseCache()
+
+# Meme lists: only the columns SimpleMeme needs, title shortened in SQL, and
+# keyset pagination on (score, id) so every page is one short index range scan.
+# The filters match the partial indexes in migrate_db.py.
+MEME_LIST_SELECT = """
+    SELECT id, file_type, score, url,
+           CASE WHEN length(title) > 50 THEN left(title, 50) || '...' ELSE title END AS title
+    FROM memes
+"""
+MEME_LIST_FILTERS = {
+    False: " WHERE url IS NOT NULL AND (uploaded_to_instagram IS NULL OR uploaded_to_instagram = FALSE)",
+    True: " WHERE url IS NOT NULL AND uploaded_to_instagram = TRUE",
+}
+MEME_LIST_AFTER = " AND (score, id) < ($2, $3)"
+MEME_LIST_ORDER = " ORDER BY score DESC, id DESC LIMIT $1"
+
+def memes_query(uploaded_only=False, after=False):
+    """SQL for one page of a meme list; $1 is the row limit, $2/$3 the cursor's score and id"""
+    query = MEME_LIST_SELECT + MEME_LIST_FILTERS[bool(uploaded_only)]
+    if after:
+        query += MEME_LIST_AFTER
+    return query + MEME_LIST_ORDER
+
+def encode_cursor(meme):
+    return base64.urlsafe_b64encode(f"{meme['score']}:{meme['id']}".encode()).decode()
+
+class ClientError(ValueError):
+    """Bad client input: returned as a GraphQL error, not logged as a server failure"""
+
+def decode_cursor(cursor):
+    """(score, id) from a cursor returned by an earlier page"""
+    try:
+        score, meme_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return int(score), int(meme_id)
+    except Exception:
+        raise ClientError(f"Invalid cursor: {cursor}") from None
+
+async def get_memes_from_db(uploaded_only=False, first=20, after=None):
+    """One page of memes from your existing database; returns (rows, has_next_page)"""
+    first = max(1, min(first, GRAPHQL_MAX_PAGE_SIZE))
+    params = [first + 1]
+    if after:
+        params.extend(decode_cursor(after))
+    
+    async def load():
+        rows = await async_db.fetch(memes_query(uploaded_only, after=bool(after)), *params)
+        return rows[:first], len(rows) > first
+    
+    try:
+        return await response_cache.get_or_load(("memes", bool(uploaded_only), first, after), load)
     except Exception as e:
         print(f"Database error: {e}")
-        return []
+        return [], False
+
+def to_meme_page(rows, has_next_page, uploaded):
+    return MemePage(
+        memes=[SimpleMeme(
+            id=m['id'],
+            title=m['title'],
+            file_type=m['file_type'],
+            score=m['score'],
+            uploaded=uploaded,
+            url=m['url']
+        ) for m in rows],
+        end_cursor=encode_cursor(rows[-1]) if rows else None,
+        has_next_page=has_next_page
+    )
+
+async def get_counters():
+    """Stats counters through the response cache, read without blocking"""
+    async def load():
+        counters = meme_stats.cached()
+        if counters is None:
+            rows = await async_db.fetch(meme_stats.COUNTERS_SQL)
+            counters = meme_stats.remember({row['name']: row['value'] for row in rows})
+        return counters
+    
+    return await response_cache.get_or_load(("counters",), load)
 
 # GraphQL Types
 @strawberry.type
@@ -59,6 +162,12 @@ class SimpleMeme:
     uploaded: bool
     url: str
 
+@strawberry.type
+class MemePage:
+    memes: List[SimpleMeme]
+    end_cursor: Optional[str]
+    has_next_page: bool
+
 @strawberry.type
 class QuickStats:
     total_available: int
@@ -67,127 +176,252 @@ class QuickStats:
     videos: int
 
 @strawberry.type
-class UploadResponse:
-    success: bool
+class PoolStats:
+    in_use: int
+    idle: int
+    max_size: int
+    checkouts: int
+    timeouts: int
+    avg_wait_time: float
+    max_wait_time: float
+
+@strawberry.type
+class ApiPoolStats:
+    size: int
+    idle: int
+    max_size: int
+    queries: int
+    errors: int
+    avg_query_time: float
+    max_query_time: float
+
+@strawberry.type
+class ResponseCacheStats:
+    hits: int
+    misses: int
+    hit_rate: float
+    invalidations: int
+    size: int
+    max_size: int
+    ttl_seconds: float
+    listening: bool
+
+@strawberry.type
+class JobInfo:
+    id: str
+    kind: str
+    state: str
+    progress: str
     message: str
+    exit_code: Optional[int]
+    created_at: str
+    started_at: Optional[str]
+    finished_at: Optional[str]
+    duration_seconds: Optional[float]
+    output_tail: List[str]
+
+def to_job_info(job):
+    return JobInfo(
+        id=job.id,
+        kind=job.kind,
+        state=job.state,
+        progress=job.progress,
+        message=job.message,
+        exit_code=job.exit_code,
+        created_at=job.created_at.isoformat(timespec='seconds'),
+        started_at=job.started_at.isoformat(timespec='seconds') if job.started_at else None,
+        finished_at=job.finished_at.isoformat(timespec='seconds') if job.finished_at else None,
+        duration_seconds=job.duration,
+        output_tail=list(job.output)
+    )
 
 # GraphQL Schema
 @strawberry.type
 class Query:
     @strawberry.field
-    def available_memes(self, limit: int = 10) -> List[SimpleMeme]:
-        """Get memes ready to upload"""
-        memes = get_memes_from_db(uploaded_only=False, limit=limit)
-        return [SimpleMeme(
-            id=m['id'],
-            title=m['title'][:50] + ('...' if len(m['title']) > 50 else ''),
-            file_type=m['file_type'],
-            score=m['score'],
-            uploaded=m['uploaded'],
-            url=m['url']
-        ) for m in memes if not m['uploaded']]
+    async def available_memes(self, first: int = 10, after: Optional[str] = None) -> MemePage:
+        """Get memes ready to upload, best first; pass endCursor as `after` for the next page"""
+        rows, has_next_page = await get_memes_from_db(uploaded_only=False, first=first, after=after)
+        return to_meme_page(rows, has_next_page, uploaded=False)
     
     @strawberry.field
-    def uploaded_memes(self, limit: int = 10) -> List[SimpleMeme]:
-        """Get already uploaded memes"""
-        memes = get_memes_from_db(uploaded_only=True, limit=limit)
-        return [SimpleMeme(
-            id=m['id'],
-            title=m['title'][:50] + ('...' if len(m['title']) > 50 else ''),
-            file_type=m['file_type'],
-            score=m['score'],
-            uploaded=m['uploaded'],
-            url=m['url']
-        ) for m in memes]
+    async def uploaded_memes(self, first: int = 10, after: Optional[str] = None) -> MemePage:
+        """Get already uploaded memes, best first; pass endCursor as `after` for the next page"""
+        rows, has_next_page = await get_memes_from_db(uploaded_only=True, first=first, after=after)
+        return to_meme_page(rows, has_next_page, uploaded=True)
     
     @strawberry.field
-    def stats(self) -> QuickStats:
+    async def stats(self) -> QuickStats:
         """Get quick statistics"""
         try:
-            conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-            SELECT 
-                COUNT(*) FILTER (WHERE COALESCE(uploaded_to_instagram, FALSE) = FALSE) as available,
-                COUNT(*) FILTER (WHERE uploaded_to_instagram = TRUE) as uploaded,
-                COUNT(*) FILTER (WHERE file_type = 'image') as images,
-                COUNT(*) FILTER (WHERE file_type = 'video') as videos
-            FROM memes WHERE url IS NOT NULL
-            """)
-            
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            
+            counters = await get_counters()
             return QuickStats(
-                total_available=result['available'] or 0,
-                total_uploaded=result['uploaded'] or 0,
-                images=result['images'] or 0,
-                videos=result['videos'] or 0
+                total_available=counters.get('url_not_uploaded', 0),
+                total_uploaded=counters.get('url_uploaded', 0),
+                images=counters.get('url_images', 0),
+                videos=counters.get('url_videos', 0)
             )
         except Exception as e:
             return QuickStats(total_available=0, total_uploaded=0, images=0, videos=0)
+    
+    @strawberry.field
+    def pool_stats(self) -> PoolStats:
+        """Get database connection pool metrics"""
+        stats = db_pool.pool_stats()
+        return PoolStats(
+            in_use=stats.get('in_use', 0),
+            idle=stats.get('idle', 0),
+            max_size=stats.get('max_size', db_pool.DB_POOL_MAX),
+            checkouts=stats.get('checkouts', 0),
+            timeouts=stats.get('timeouts', 0),
+            avg_wait_time=stats.get('avg_wait_time', 0.0),
+            max_wait_time=stats.get('max_wait_time', 0.0)
+        )
+    
+    @strawberry.field
+    def response_cache_stats(self) -> ResponseCacheStats:
+        """Get response cache hit/miss counters (for tuning GRAPHQL_CACHE_TTL)"""
+        lookups = response_cache.hits + response_cache.misses
+        return ResponseCacheStats(
+            hits=response_cache.hits,
+            misses=response_cache.misses,
+            hit_rate=response_cache.hits / lookups if lookups else 0.0,
+            invalidations=response_cache.invalidations,
+            size=len(response_cache.entries),
+            max_size=response_cache.max_size,
+            ttl_seconds=response_cache.ttl,
+            listening=response_cache.listening
+        )
+    
+    @strawberry.field
+    def job(self, id: str) -> Optional[JobInfo]:
+        """Get a background job by id"""
+        job = background_jobs.get_manager().get(id)
+        return to_job_info(job) if job else None
+    
+    @strawberry.field
+    def jobs(self, limit: int = 20) -> List[JobInfo]:
+        """Get the most recent background jobs"""
+        return [to_job_info(job) for job in background_jobs.get_manager().recent(limit)]
+    
+    @strawberry.field
+    def api_pool_stats(self) -> ApiPoolStats:
+        """Get the GraphQL API's async pool metrics"""
+        stats = async_db.pool_stats()
+        return ApiPoolStats(
+            size=stats['size'],
+            idle=stats['idle'],
+            max_size=stats['max_size'],
+            queries=stats['queries'],
+            errors=stats['errors'],
+            avg_query_time=stats['avg_query_time'],
+            max_query_time=stats['max_query_time']
+        )
 
 @strawberry.type
 class Mutation:
     @strawberry.mutation
-    async def upload_next_meme(self) -> UploadResponse:
-        """Upload the next best meme (uses your existing uploader)"""
-        try:
-            result = subprocess.run([
-                sys.executable, "cloud_instagram_uploader.py"
-            ], capture_output=True, text=True, timeout=900)
-            
-            if result.returncode == 0:
-                return UploadResponse(
-                    success=True,
-                    message="✅ Meme uploaded successfully!"
-                )
-            else:
-                return UploadResponse(
-                    success=False,
-                    message=f"❌ Upload failed: {result.stderr[:100]}"
-                )
-        except Exception as e:
-            return UploadResponse(
-                success=False,
-                message=f"❌ Error: {str(e)[:100]}"
-            )
+    def upload_next_meme(self) -> JobInfo:
+        """Queue an upload of the next best meme; returns the job to follow"""
+        return to_job_info(background_jobs.get_manager().submit("upload"))
     
     @strawberry.mutation
-    async def fetch_new_memes(self) -> UploadResponse:
-        """Fetch new memes (uses your existing fetcher)"""
-        try:
-            result = subprocess.run([
-                sys.executable, "cloud_meme_fetcher.py"
-            ], capture_output=True, text=True, timeout=600)
-            
-            if result.returncode == 0:
-                return UploadResponse(
-                    success=True,
-                    message="✅ New memes fetched successfully!"
-                )
-            else:
-                return UploadResponse(
-                    success=False,
-                    message=f"❌ Fetch failed: {result.stderr[:100]}"
-                )
-        except Exception as e:
-            return UploadResponse(
-                success=False,
-                message=f"❌ Error: {str(e)[:100]}"
-            )
+    def fetch_new_memes(self) -> JobInfo:
+        """Queue a run of the existing fetcher; returns the job to follow"""
+        return to_job_info(background_jobs.get_manager().submit("fetch"))
+
+@strawberry.type
+class Subscription:
+    @strawberry.subscription
+    async def job_updates(self, id: str) -> AsyncGenerator[JobInfo, None]:
+        """Stream a job's state until it finishes"""
+        job = background_jobs.get_manager().get(id)
+        if not job:
+            return
+        while True:
+            yield to_job_info(job)
+            if not job.active:
+                break
+            await job.wait_for_change(timeout=30)
 
 # Create FastAPI app
 app = FastAPI(title="Meme Bot GraphQL API")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"])
 
 # Add GraphQL
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+class MemeSchema(strawberry.Schema):
+    def process_errors(self, errors, execution_context=None):
+        # Client errors already reach the caller; only log real failures
+        errors = [e for e in errors if not isinstance(e.original_error, ClientError)]
+        super().process_errors(errors, execution_context)
+
+schema = MemeSchema(query=Query, mutation=Mutation, subscription=Subscription)
 graphql_app = GraphQLRouter(schema, graphiql=True)
 app.include_router(graphql_app, prefix="/graphql")
 
+_listener = None
+_reconnect_task = None
+_shutting_down = False
+
+async def _listen_for_changes():
+    global _listener
+    _listener = await async_db.listen(
+        migrate_db.MEMES_CHANGED_CHANNEL,
+        lambda payload: response_cache.invalidate(),
+        on_lost=_listener_lost
+    )
+    response_cache.listening = True
+
+async def _reconnect_listener():
+    """Re-LISTEN with exponential backoff; the TTL covers the gap"""
+    global _reconnect_task
+    delay = 1.0
+    while not _shutting_down:
+        await asyncio.sleep(delay)
+        try:
+            await _listen_for_changes()
+        except Exception as e:
+            delay = min(delay * 2, GRAPHQL_LISTEN_RETRY_MAX)
+            print(f"⚠️ Listener reconnect failed ({e}), retrying in {delay:.0f}s")
+            continue
+        # Writes made while disconnected were never announced
+        response_cache.invalidate()
+        print(f"👂 Reconnected {migrate_db.MEMES_CHANGED_CHANNEL} listener")
+        break
+    _reconnect_task = None
+
+def _start_reconnect():
+    global _reconnect_task
+    if _reconnect_task is None and not _shutting_down:
+        _reconnect_task = asyncio.get_running_loop().create_task(_reconnect_listener())
+
+def _listener_lost():
+    response_cache.listening = False
+    if _shutting_down:
+        return
+    response_cache.invalidate()
+    print(f"⚠️ Lost {migrate_db.MEMES_CHANGED_CHANNEL} listener, reconnecting (response cache falls back to its TTL)")
+    _start_reconnect()
+
+@app.on_event("startup")
+async def start_cache_invalidation():
+    background_jobs.get_manager().on_finish.append(lambda job: response_cache.invalidate())
+    try:
+        await _listen_for_changes()
+    except Exception as e:
+        print(f"⚠️ Could not listen for meme changes ({e}), retrying (response cache falls back to its TTL)")
+        _start_reconnect()
+
+@app.on_event("shutdown")
+async def close_async_pool():
+    global _shutting_down
+    _shutting_down = True
+    if _reconnect_task is not None:
+        _reconnect_task.cancel()
+    if _listener is not None:
+        await _listener.close()
+    await async_db.close_pool()
+
 @app.get("/")
 async def root():
     return {"message": "GraphQL at /graphql"}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Queue statistics from incrementally maintained counters
+Reads the meme_counters table (kept exact by triggers, see migrate_db.py)
+through a short-TTL in-process cache, so stats cost one tiny primary-key
+table read at most every few seconds regardless of how big memes grows.
+"""
+
+import os
+import time
+import threading
+import logging
+from datetime import datetime, timezone
+import db_pool
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", 5))
+
+COUNTERS_SQL = "SELECT name, value FROM meme_counters"
+
+_counters = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+def read_counters(database_url=None):
+    """All counters straight from the database"""
+    with db_pool.get_connection(database_url=database_url) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(COUNTERS_SQL)
+            return dict(cursor.fetchall())
+
+
+def cached(max_age=STATS_CACHE_TTL):
+    """The cached counters if younger than `max_age` seconds, else None"""
+    with _lock:
+        if _counters is not None and time.monotonic() - _loaded_at < max_age:
+            return _counters
+        return None
+
+
+def remember(counters):
+    """Store freshly read counters (used by async readers) and return them"""
+    global _counters, _loaded_at
+    with _lock:
+        _counters = counters
+        _loaded_at = time.monotonic()
+    return counters
+
+
+def get_counters(max_age=STATS_CACHE_TTL, database_url=None):
+    """Counters, re-read only when the cached copy is older than `max_age` seconds"""
+    counters = cached(max_age)
+    if counters is None:
+        counters = remember(read_counters(database_url))
+    return counters
+
+
+def invalidate():
+    """Make the next read go to the database (call after writes in this process)"""
+    global _loaded_at
+    with _lock:
+        _loaded_at = 0.0
+
+
+def last_fetch(counters):
+    """Newest memes.downloaded_at as the naive timestamp the column stores"""
+    epoch = counters.get("last_fetch_epoch")
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
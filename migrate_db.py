@@ -1,117 +1,448 @@
 #!/usr/bin/env python3
 """
 Database Migration Script for Instagram Meme Bot
-Adds missing columns to the memes table
+Versioned migrations recorded in a schema_version table. Run this script
+to upgrade the schema; runtime code only checks the version (once per
+process) and never issues DDL itself.
 """
 
 import os
+import threading
 import psycopg2
 import logging
+import db_pool
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Migrations run from preflight.py (start.sh) or this script; set true to also let a
+# runtime process that finds an outdated schema migrate it
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+# pg_advisory_lock key so only one process migrates at a time
+MIGRATION_LOCK_ID = 724501
+
+# Partial composite indexes for the queue queries. Each predicate is written
+# exactly as the query spells it so the planner can match the index, and the
+# key order matches the ORDER BY so LIMIT reads only the top of the index.
+QUEUE_INDEXES = {
+    # cloud_instagram_uploader.CLAIM_MEMES_SQL and the GraphQL available list
+    "idx_memes_upload_queue": """
+        CREATE INDEX IF NOT EXISTS idx_memes_upload_queue ON memes (score DESC, id DESC)
+        WHERE url IS NOT NULL AND ((uploaded_to_instagram IS NULL) OR (uploaded_to_instagram = FALSE));
+    """,
+    # GraphQL uploaded list
+    "idx_memes_uploaded_feed": """
+        CREATE INDEX IF NOT EXISTS idx_memes_uploaded_feed ON memes (score DESC, id DESC)
+        WHERE url IS NOT NULL AND uploaded_to_instagram = TRUE;
+    """,
+    # cloud_meme_fetcher.NEXT_MEME_CLAIM_SQL with a file type
+    "idx_memes_post_queue": """
+        CREATE INDEX IF NOT EXISTS idx_memes_post_queue ON memes (file_type, score DESC, downloaded_at)
+        WHERE posted = FALSE AND failed_attempts < 3;
+    """,
+    # cloud_meme_fetcher.NEXT_MEME_CLAIM_SQL without a file type (migration 11)
+    "idx_memes_post_queue_any": """
+        CREATE INDEX IF NOT EXISTS idx_memes_post_queue_any ON memes (score DESC, downloaded_at)
+        WHERE posted = FALSE AND failed_attempts < 3;
+    """,
+    # cloud_meme_fetcher.UNHASHED_IMAGES_SQL (phash backfill)
+    "idx_memes_unhashed_images": """
+        CREATE INDEX IF NOT EXISTS idx_memes_unhashed_images ON memes (id)
+        WHERE phash IS NULL AND file_type = 'image' AND url IS NOT NULL;
+    """,
+}
+
+# LISTEN/NOTIFY channel raised by every write to memes (migration 8)
+MEMES_CHANGED_CHANNEL = "memes_changed"
+
+# (version, description, SQL). Append only - never edit a released step.
+# Steps are idempotent so databases built by the old ad-hoc DDL upgrade cleanly.
+MIGRATIONS = [
+    (1, "base tables", """
+        CREATE TABLE IF NOT EXISTS memes (
+            id SERIAL PRIMARY KEY,
+            post_id VARCHAR(50) UNIQUE,
+            title TEXT,
+            url TEXT,
+            file_type VARCHAR(10),
+            file_size INTEGER DEFAULT 0,
+            subreddit VARCHAR(50),
+            score INTEGER DEFAULT 0,
+            downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            posted BOOLEAN DEFAULT FALSE,
+            post_date TIMESTAMP NULL,
+            failed_attempts INTEGER DEFAULT 0
+        );
+
+        CREATE TABLE IF NOT EXISTS fetch_history (
+            id SERIAL PRIMARY KEY,
+            fetch_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            images_fetched INTEGER,
+            videos_fetched INTEGER,
+            total_processed INTEGER,
+            errors TEXT
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_memes_posted ON memes(posted);
+        CREATE INDEX IF NOT EXISTS idx_memes_type ON memes(file_type);
+    """),
+    (2, "instagram upload columns", """
+        ALTER TABLE memes
+        ADD COLUMN IF NOT EXISTS uploaded_to_instagram BOOLEAN DEFAULT FALSE,
+        ADD COLUMN IF NOT EXISTS uploaded_at TIMESTAMP DEFAULT NULL,
+        ADD COLUMN IF NOT EXISTS instagram_post_id VARCHAR(50) DEFAULT NULL;
+
+        CREATE INDEX IF NOT EXISTS idx_memes_uploaded_instagram ON memes(uploaded_to_instagram);
+        CREATE INDEX IF NOT EXISTS idx_memes_uploaded_at ON memes(uploaded_at);
+        CREATE INDEX IF NOT EXISTS idx_memes_score ON memes(score DESC);
+    """),
+    (3, "perceptual hashes", """
+        ALTER TABLE memes ADD COLUMN IF NOT EXISTS phash BIGINT DEFAULT NULL;
+    """),
+    (4, "per-source fetch history and incremental fetch cursors", """
+        ALTER TABLE fetch_history
+        ADD COLUMN IF NOT EXISTS subreddit VARCHAR(50),
+        ADD COLUMN IF NOT EXISTS listing VARCHAR(20),
+        ADD COLUMN IF NOT EXISTS skipped_known INTEGER DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS elapsed_seconds REAL;
+
+        CREATE TABLE IF NOT EXISTS fetch_cursors (
+            subreddit VARCHAR(50),
+            listing VARCHAR(20),
+            last_seen_fullnames TEXT[] DEFAULT '{}',
+            last_seen_utc DOUBLE PRECISION,
+            last_full_scan_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (subreddit, listing)
+        );
+    """),
+    (5, "queue claim leases", """
+        ALTER TABLE memes
+        ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(100) DEFAULT NULL,
+        ADD COLUMN IF NOT EXISTS claim_expires_at TIMESTAMP DEFAULT NULL;
+    """),
+    (6, "partial queue indexes", "".join(QUEUE_INDEXES[name] for name in (
+        "idx_memes_upload_queue", "idx_memes_uploaded_feed", "idx_memes_post_queue", "idx_memes_unhashed_images"))),
+    # Statement-level triggers keep meme_counters exact for every writer
+    # (batched inserts, claims, uploads, reconciliation) - see meme_stats.py
+    (7, "incrementally maintained meme counters", """
+        CREATE TABLE IF NOT EXISTS meme_counters (
+            name VARCHAR(50) PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        );
+
+        -- Which counters a row contributes to
+        CREATE OR REPLACE FUNCTION meme_counter_names(r memes) RETURNS SETOF TEXT
+        LANGUAGE sql IMMUTABLE AS $fn$
+            SELECT name FROM (VALUES
+                ('total', TRUE),
+                ('images', r.file_type = 'image'),
+                ('videos', r.file_type = 'video'),
+                ('available', r.posted = FALSE AND r.failed_attempts < 3),
+                ('posted', r.posted = TRUE),
+                ('url_images', r.url IS NOT NULL AND r.file_type = 'image'),
+                ('url_videos', r.url IS NOT NULL AND r.file_type = 'video'),
+                ('url_not_uploaded', r.url IS NOT NULL AND COALESCE(r.uploaded_to_instagram, FALSE) = FALSE),
+                ('url_uploaded', r.url IS NOT NULL AND r.uploaded_to_instagram = TRUE)
+            ) AS c(name, hit)
+            WHERE hit
+        $fn$;
+
+        -- Applies the net change of one statement (rows counted once per statement)
+        CREATE OR REPLACE FUNCTION meme_counters_apply() RETURNS trigger
+        LANGUAGE plpgsql AS $fn$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO meme_counters (name, value)
+                SELECT n, COUNT(*) FROM new_rows r, meme_counter_names(r) n GROUP BY n ORDER BY n
+                ON CONFLICT (name) DO UPDATE SET value = meme_counters.value + EXCLUDED.value;
+
+                INSERT INTO meme_counters (name, value)
+                SELECT 'last_fetch_epoch', EXTRACT(EPOCH FROM MAX(downloaded_at))::BIGINT FROM new_rows
+                HAVING MAX(downloaded_at) IS NOT NULL
+                ON CONFLICT (name) DO UPDATE SET value = GREATEST(meme_counters.value, EXCLUDED.value);
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO meme_counters (name, value)
+                SELECT name, SUM(delta) FROM (
+                    SELECT n AS name, 1 AS delta FROM new_rows r, meme_counter_names(r) n
+                    UNION ALL
+                    SELECT n, -1 FROM old_rows r, meme_counter_names(r) n
+                ) changes
+                GROUP BY name HAVING SUM(delta) <> 0 ORDER BY name
+                ON CONFLICT (name) DO UPDATE SET value = meme_counters.value + EXCLUDED.value;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO meme_counters (name, value)
+                SELECT n, -COUNT(*) FROM old_rows r, meme_counter_names(r) n GROUP BY n ORDER BY n
+                ON CONFLICT (name) DO UPDATE SET value = meme_counters.value + EXCLUDED.value;
+            ELSE
+                DELETE FROM meme_counters;
+            END IF;
+            RETURN NULL;
+        END
+        $fn$;
+
+        DROP TRIGGER IF EXISTS memes_counters_insert ON memes;
+        CREATE TRIGGER memes_counters_insert AFTER INSERT ON memes
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION meme_counters_apply();
+        DROP TRIGGER IF EXISTS memes_counters_update ON memes;
+        CREATE TRIGGER memes_counters_update AFTER UPDATE ON memes
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION meme_counters_apply();
+        DROP TRIGGER IF EXISTS memes_counters_delete ON memes;
+        CREATE TRIGGER memes_counters_delete AFTER DELETE ON memes
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION meme_counters_apply();
+        DROP TRIGGER IF EXISTS memes_counters_truncate ON memes;
+        CREATE TRIGGER memes_counters_truncate AFTER TRUNCATE ON memes
+            FOR EACH STATEMENT EXECUTE FUNCTION meme_counters_apply();
+
+        -- Seed from the current table while writers are held off
+        LOCK TABLE memes IN SHARE MODE;
+        DELETE FROM meme_counters;
+        INSERT INTO meme_counters (name, value)
+        SELECT n, COUNT(*) FROM memes r, meme_counter_names(r) n GROUP BY n;
+        INSERT INTO meme_counters (name, value)
+        SELECT 'last_fetch_epoch', EXTRACT(EPOCH FROM MAX(downloaded_at))::BIGINT FROM memes
+        HAVING MAX(downloaded_at) IS NOT NULL;
+    """),
+    # One NOTIFY per writing statement, delivered on commit, so API response
+    # caches in other processes can drop stale entries (see meme_graphql.py)
+    (8, "memes change notifications", """
+        CREATE OR REPLACE FUNCTION memes_notify_change() RETURNS trigger
+        LANGUAGE plpgsql AS $fn$
+        BEGIN
+            PERFORM pg_notify('""" + MEMES_CHANGED_CHANNEL + """', TG_OP);
+            RETURN NULL;
+        END
+        $fn$;
+
+        DROP TRIGGER IF EXISTS memes_notify_change ON memes;
+        CREATE TRIGGER memes_notify_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON memes
+            FOR EACH STATEMENT EXECUTE FUNCTION memes_notify_change();
+    """),
+    # Every write of a phash (insert or backfill) gets a fresh sequence number,
+    # so long-lived fetchers can pick up backfilled hashes incrementally
+    (9, "perceptual hash write sequence", """
+        CREATE SEQUENCE IF NOT EXISTS memes_phash_seq;
+        ALTER TABLE memes ADD COLUMN IF NOT EXISTS phash_seq BIGINT DEFAULT NULL;
+
+        CREATE OR REPLACE FUNCTION memes_stamp_phash() RETURNS trigger
+        LANGUAGE plpgsql AS $fn$
+        BEGIN
+            IF NEW.phash IS NOT NULL AND (TG_OP = 'INSERT' OR NEW.phash IS DISTINCT FROM OLD.phash) THEN
+                NEW.phash_seq := nextval('memes_phash_seq');
+            END IF;
+            RETURN NEW;
+        END
+        $fn$;
+
+        DROP TRIGGER IF EXISTS memes_stamp_phash ON memes;
+        CREATE TRIGGER memes_stamp_phash BEFORE INSERT OR UPDATE OF phash ON memes
+            FOR EACH ROW EXECUTE FUNCTION memes_stamp_phash();
+
+        UPDATE memes SET phash_seq = nextval('memes_phash_seq')
+        WHERE phash IS NOT NULL AND phash_seq IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_memes_phash_seq ON memes (phash_seq) WHERE phash_seq IS NOT NULL;
+    """),
+    # Notify only for statements that touched rows, and for updates only when a
+    # column the API or the counters read changed - claims and hash backfills stay
+    # quiet. Postgres rejects UPDATE OF column lists on triggers with transition
+    # tables, so the column check lives in the function.
+    (10, "notify only on visible meme changes", """
+        CREATE OR REPLACE FUNCTION memes_notify_change() RETURNS trigger
+        LANGUAGE plpgsql AS $fn$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                IF NOT EXISTS (SELECT 1 FROM new_rows) THEN
+                    RETURN NULL;
+                END IF;
+            ELSIF TG_OP = 'UPDATE' THEN
+                IF NOT EXISTS (
+                    SELECT 1 FROM new_rows n JOIN old_rows o ON o.id = n.id
+                    WHERE (n.title, n.url, n.file_type, n.score, n.downloaded_at, n.posted,
+                           n.failed_attempts, n.uploaded_to_instagram, n.uploaded_at)
+                        IS DISTINCT FROM
+                          (o.title, o.url, o.file_type, o.score, o.downloaded_at, o.posted,
+                           o.failed_attempts, o.uploaded_to_instagram, o.uploaded_at)
+                ) THEN
+                    RETURN NULL;
+                END IF;
+            ELSIF TG_OP = 'DELETE' THEN
+                IF NOT EXISTS (SELECT 1 FROM old_rows) THEN
+                    RETURN NULL;
+                END IF;
+            END IF;
+            PERFORM pg_notify('""" + MEMES_CHANGED_CHANNEL + """', TG_OP);
+            RETURN NULL;
+        END
+        $fn$;
+
+        DROP TRIGGER IF EXISTS memes_notify_change ON memes;
+        DROP TRIGGER IF EXISTS memes_notify_insert ON memes;
+        CREATE TRIGGER memes_notify_insert AFTER INSERT ON memes
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION memes_notify_change();
+        DROP TRIGGER IF EXISTS memes_notify_update ON memes;
+        CREATE TRIGGER memes_notify_update AFTER UPDATE ON memes
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION memes_notify_change();
+        DROP TRIGGER IF EXISTS memes_notify_delete ON memes;
+        CREATE TRIGGER memes_notify_delete AFTER DELETE ON memes
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION memes_notify_change();
+        DROP TRIGGER IF EXISTS memes_notify_truncate ON memes;
+        CREATE TRIGGER memes_notify_truncate AFTER TRUNCATE ON memes
+            FOR EACH STATEMENT EXECUTE FUNCTION memes_notify_change();
+    """),
+    (11, "untyped post queue index", QUEUE_INDEXES["idx_memes_post_queue_any"]),
+    # GraphQL list cursors encode (score, id); a NULL score can't be paged past
+    (12, "memes.score not null", """
+        UPDATE memes SET score = 0 WHERE score IS NULL;
+        ALTER TABLE memes ALTER COLUMN score SET DEFAULT 0;
+        ALTER TABLE memes ALTER COLUMN score SET NOT NULL;
+    """),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(cursor):
+    """Highest applied migration, 0 for a database that has never been migrated"""
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def run_migrations(database_url=None):
+    """Apply every pending migration, each in its own transaction; returns the resulting version"""
+    conn = psycopg2.connect(database_url or DATABASE_URL)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            conn.commit()
+
+            current = get_schema_version(cursor)
+            pending = [m for m in MIGRATIONS if m[0] > current]
+            if not pending:
+                logger.info(f"✅ Schema is current (v{current})")
+                return current
+
+            for version, description, sql in pending:
+                logger.info(f"🔧 Applying migration v{version}: {description}")
+                cursor.execute(sql)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+                current = version
+
+            logger.info(f"✅ Schema migrated to v{current}")
+            return current
+        finally:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            conn.commit()
+    finally:
+        conn.close()
+
+
+_schema_checked = False
+_schema_lock = threading.Lock()
+
+
+def ensure_schema(auto_migrate=AUTO_MIGRATE):
+    """Cached once-per-process check that the database is at SCHEMA_VERSION
+
+    After the first successful check this is a flag lookup. An outdated
+    schema is migrated here only when AUTO_MIGRATE is enabled.
+    """
+    global _schema_checked
+    if _schema_checked:
+        return True
+
+    with _schema_lock:
+        if _schema_checked:
+            return True
+
+        with db_pool.get_connection() as conn:
+            with conn.cursor() as cursor:
+                version = get_schema_version(cursor)
+
+        if version < SCHEMA_VERSION:
+            if not auto_migrate:
+                logger.error(f"❌ Database schema is v{version}, code needs v{SCHEMA_VERSION} - run migrate_db.py")
+                return False
+            logger.warning(f"⚠️ Database schema is v{version}, migrating to v{SCHEMA_VERSION}")
+            version = run_migrations()
+
+        _schema_checked = version >= SCHEMA_VERSION
+        return _schema_checked
+
 
 def migrate_database():
-    """Add missing columns to memes table"""
+    """Bring the schema up to date and report the resulting table"""
     if not DATABASE_URL:
         logger.error("❌ DATABASE_URL not found!")
         return False
-    
+
     try:
-        # Connect to database
         logger.info("🔌 Connecting to database...")
+        version = run_migrations()
+
         conn = psycopg2.connect(DATABASE_URL)
         cursor = conn.cursor()
-        
-        # Check current table structure
-        cursor.execute("""
-            SELECT column_name, data_type 
-            FROM information_schema.columns 
-            WHERE table_name = 'memes' AND table_schema = 'public'
-            ORDER BY ordinal_position;
-        """)
-        
-        existing_columns = {row[0]: row[1] for row in cursor.fetchall()}
-        logger.info(f"📊 Found {len(existing_columns)} existing columns: {list(existing_columns.keys())}")
-        
-        # Add missing columns
-        migrations = []
-        
-        if 'uploaded_to_instagram' not in existing_columns:
-            migrations.append("ADD COLUMN uploaded_to_instagram BOOLEAN DEFAULT FALSE")
-            
-        if 'uploaded_at' not in existing_columns:
-            migrations.append("ADD COLUMN uploaded_at TIMESTAMP DEFAULT NULL")
-            
-        if 'instagram_post_id' not in existing_columns:
-            migrations.append("ADD COLUMN instagram_post_id VARCHAR(50) DEFAULT NULL")
-            
-        if migrations:
-            migration_sql = "ALTER TABLE memes " + ", ".join(migrations) + ";"
-            logger.info(f"🔧 Running migration: {migration_sql}")
-            
-            cursor.execute(migration_sql)
-            conn.commit()
-            logger.info("✅ Migration completed successfully")
-        else:
-            logger.info("✅ No migrations needed - all columns exist")
-        
-        # Create indexes for better performance
-        index_queries = [
-            "CREATE INDEX IF NOT EXISTS idx_memes_uploaded_instagram ON memes(uploaded_to_instagram);",
-            "CREATE INDEX IF NOT EXISTS idx_memes_uploaded_at ON memes(uploaded_at);",
-            "CREATE INDEX IF NOT EXISTS idx_memes_score ON memes(score DESC);"
-        ]
-        
-        for query in index_queries:
-            try:
-                cursor.execute(query)
-                conn.commit()
-                logger.info(f"✅ Index created: {query.split()[4]}")
-            except Exception as e:
-                logger.warning(f"⚠️ Index creation warning: {e}")
-        
+
         # Show final table structure
         cursor.execute("""
             SELECT column_name, data_type, is_nullable, column_default
-            FROM information_schema.columns 
+            FROM information_schema.columns
             WHERE table_name = 'memes' AND table_schema = 'public'
             ORDER BY ordinal_position;
         """)
-        
+
         columns = cursor.fetchall()
-        logger.info("📋 Final table structure:")
+        logger.info(f"📋 Final table structure (schema v{version}):")
         for col in columns:
             logger.info(f"   {col[0]} ({col[1]}) - Nullable: {col[2]}, Default: {col[3]}")
-        
+
         # Show current data count
         cursor.execute("SELECT COUNT(*) FROM memes;")
         total_memes = cursor.fetchone()[0]
-        
+
         cursor.execute("SELECT COUNT(*) FROM memes WHERE uploaded_to_instagram = TRUE;")
         uploaded_count = cursor.fetchone()[0]
-        
+
         cursor.execute("SELECT COUNT(*) FROM memes WHERE uploaded_to_instagram IS NULL OR uploaded_to_instagram = FALSE;")
         available_count = cursor.fetchone()[0]
-        
+
         logger.info(f"📊 Memes status:")
         logger.info(f"   Total: {total_memes}")
         logger.info(f"   Uploaded: {uploaded_count}")
         logger.info(f"   Available: {available_count}")
-        
+
         cursor.close()
         conn.close()
-        
+
         return True
-        
+
     except Exception as e:
         logger.error(f"❌ Migration failed: {e}")
         return False
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     print("🔧 Running database migration...")
     success = migrate_database()
     if success:
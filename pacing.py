@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Condition-driven pacing for the Instagram browser flows
+Waits on real page conditions instead of fixed sleeps, adds a bounded
+amount of random jitter on top, and reports waiting vs working time per step.
+"""
+
+import os
+import time
+import random
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+# Total random "human" delay allowed per flow (login, upload), in seconds
+PACING_JITTER_BUDGET = float(os.getenv("PACING_JITTER_BUDGET", 8))
+PACING_JITTER_MIN = float(os.getenv("PACING_JITTER_MIN", 0.3))
+PACING_JITTER_MAX = float(os.getenv("PACING_JITTER_MAX", 1.5))
+
+
+class Pacer:
+    """Per-flow pacing: condition waits, budgeted jitter and step timings"""
+
+    def __init__(self, driver, name, jitter_budget=PACING_JITTER_BUDGET,
+                 jitter_min=PACING_JITTER_MIN, jitter_max=PACING_JITTER_MAX):
+        self.driver = driver
+        self.name = name
+        self.jitter_remaining = jitter_budget
+        self.jitter_min = jitter_min
+        self.jitter_max = jitter_max
+        self.steps = []
+        self._current = None
+
+    @contextmanager
+    def step(self, name):
+        """Time a named step; waits and jitter inside it are attributed to it"""
+        timing = {"step": name, "total": 0.0, "waiting": 0.0, "jitter": 0.0}
+        previous, self._current = self._current, timing
+        started = time.monotonic()
+        try:
+            yield timing
+        finally:
+            timing["total"] = time.monotonic() - started
+            timing["working"] = max(0.0, timing["total"] - timing["waiting"] - timing["jitter"])
+            self.steps.append(timing)
+            self._current = previous
+
+    def wait_for(self, condition, timeout=15, jitter=True):
+        """Wait until `condition` holds (a Selenium expected condition), then jitter"""
+        from selenium.webdriver.support.ui import WebDriverWait
+        started = time.monotonic()
+        try:
+            return WebDriverWait(self.driver, timeout, poll_frequency=0.2).until(condition)
+        finally:
+            if self._current is not None:
+                self._current["waiting"] += time.monotonic() - started
+            if jitter:
+                self.jitter()
+
+    def jitter(self, low=None, high=None):
+        """Random pause, clipped to what is left of the flow's jitter budget"""
+        low = self.jitter_min if low is None else low
+        high = self.jitter_max if high is None else high
+        delay = min(random.uniform(low, high), self.jitter_remaining)
+        if delay <= 0:
+            return 0.0
+
+        self.jitter_remaining -= delay
+        time.sleep(delay)
+        if self._current is not None:
+            self._current["jitter"] += delay
+        return delay
+
+    def report(self):
+        """Log how each step's time split between waiting, jitter and work"""
+        total = sum(s["total"] for s in self.steps)
+        waiting = sum(s["waiting"] for s in self.steps)
+        jitter = sum(s["jitter"] for s in self.steps)
+        logger.info(f"⏱️ {self.name}: {total:.1f}s total, {waiting:.1f}s waiting on page, "
+                    f"{jitter:.1f}s jitter, {total - waiting - jitter:.1f}s working")
+        for s in self.steps:
+            logger.info(f"   {s['step']}: {s['total']:.1f}s "
+                        f"(waiting {s['waiting']:.1f}s, jitter {s['jitter']:.1f}s, working {s['working']:.1f}s)")
+        return self.steps
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Startup preflight checks
+Runs the browser, dependency, Chrome smoke, database and migration checks in
+parallel instead of one after another. Checks that only depend on the image
+(browser, dependencies, Chrome smoke test) are cached per image build, so a
+restart of the same build skips them. Exits 1 when the browser is missing.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+DATABASE_URL = os.getenv("DATABASE_URL")
+PREFLIGHT_CACHE_FILE = os.getenv("PREFLIGHT_CACHE_FILE", ".preflight_cache.json")
+# Set by the image build (see Dockerfile); otherwise derived from the installed browser and requirements
+PREFLIGHT_BUILD_ID = os.getenv("PREFLIGHT_BUILD_ID")
+CHROME_TEST_TIMEOUT = int(os.getenv("CHROME_TEST_TIMEOUT", 30))
+CHROMEDRIVER_PATH = "/usr/local/bin/chromedriver"
+
+CHROME_SMOKE_TEST = """
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+
+chrome_options = Options()
+chrome_options.add_argument('--headless=new')
+chrome_options.add_argument('--no-sandbox')
+chrome_options.add_argument('--disable-dev-shm-usage')
+
+driver = webdriver.Chrome(service=Service('/usr/local/bin/chromedriver'), options=chrome_options)
+try:
+    driver.get('data:text/html,<html><body><h1>Test</h1></body></html>')
+    assert 'Test' in driver.page_source
+finally:
+    driver.quit()
+"""
+
+
+def command_output(*argv):
+    try:
+        return subprocess.run(argv, capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+
+def build_id():
+    """Identifies the image build the cached results belong to"""
+    if PREFLIGHT_BUILD_ID:
+        return PREFLIGHT_BUILD_ID
+    if os.path.exists(".build_id"):
+        with open(".build_id") as f:
+            return f.read().strip()
+
+    fingerprint = hashlib.sha1(sys.version.encode())
+    for binary in ("google-chrome", "chromedriver"):
+        path = shutil.which(binary)
+        if path:
+            stat = os.stat(path)
+            fingerprint.update(f"{path}:{stat.st_size}:{stat.st_mtime}".encode())
+    if os.path.exists("requirements.txt"):
+        with open("requirements.txt", "rb") as f:
+            fingerprint.update(f.read())
+    return fingerprint.hexdigest()
+
+
+def load_cache(build):
+    try:
+        with open(PREFLIGHT_CACHE_FILE) as f:
+            cache = json.load(f)
+        return cache["results"] if cache.get("build") == build else {}
+    except Exception:
+        return {}
+
+
+def save_cache(build, results):
+    try:
+        with open(PREFLIGHT_CACHE_FILE, "w") as f:
+            json.dump({"build": build, "results": results}, f)
+    except Exception as e:
+        print(f"   ⚠️  Could not save preflight cache: {e}")
+
+
+# Each check returns (ok, lines, fatal)
+
+def check_browser():
+    lines = []
+    if not shutil.which("google-chrome"):
+        return False, ["❌ Chrome not found!"], True
+    lines.append(f"✅ Chrome: {command_output('google-chrome', '--version') or 'Version check failed'}")
+
+    if not shutil.which("chromedriver"):
+        return False, lines + ["❌ ChromeDriver not found!", f"💡 Expected at {CHROMEDRIVER_PATH}"], True
+    lines.append(f"✅ ChromeDriver: {command_output('chromedriver', '--version') or 'Version check failed'}")
+
+    if not os.access(CHROMEDRIVER_PATH, os.X_OK):
+        lines.append("⚠️  ChromeDriver permissions issue, fixing...")
+        try:
+            os.chmod(CHROMEDRIVER_PATH, 0o755)
+        except OSError as e:
+            return False, lines + [f"❌ Could not fix permissions: {e}"], True
+    return True, lines, False
+
+
+def check_dependencies():
+    try:
+        import selenium
+        import psycopg2
+        import praw
+    except ImportError as e:
+        return False, [f"⚠️  Some Python dependencies missing: {e}"], False
+    return True, [
+        "✅ All Python dependencies available",
+        f"Selenium: {selenium.__version__}",
+        f"psycopg2: {psycopg2.__version__}",
+        f"praw: {praw.__version__}",
+    ], False
+
+
+def check_chrome():
+    try:
+        result = subprocess.run([sys.executable, "-c", CHROME_SMOKE_TEST],
+                                capture_output=True, text=True, timeout=CHROME_TEST_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return False, ["❌ Chrome test timed out"], False
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["unknown error"])[-1]
+        return False, [f"❌ Chrome test failed: {error}"], False
+    return True, ["✅ Chrome driver test passed"], False
+
+
+def check_database():
+    if not DATABASE_URL:
+        return False, ["❌ DATABASE_URL not set"], False
+    import psycopg2
+    try:
+        conn = psycopg2.connect(DATABASE_URL, connect_timeout=10)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT version();")
+                lines = [f"✅ PostgreSQL: {cursor.fetchone()[0][:50]}..."]
+                # The counters table answers without scanning memes
+                cursor.execute("SELECT to_regclass('public.meme_counters'), to_regclass('public.memes');")
+                counters, memes = cursor.fetchone()
+                if counters:
+                    cursor.execute("SELECT COALESCE(SUM(value), 0) FROM meme_counters WHERE name = 'total';")
+                    lines.append(f"✅ Memes table: {cursor.fetchone()[0]} records")
+                elif memes:
+                    cursor.execute("SELECT COUNT(*) FROM memes;")
+                    lines.append(f"✅ Memes table: {cursor.fetchone()[0]} records")
+                else:
+                    lines.append("⚠️  Memes table not found")
+        finally:
+            conn.close()
+    except Exception as e:
+        return False, [f"❌ Database error: {e}"], False
+    return True, lines, False
+
+
+def check_migrations():
+    """Apply pending schema migrations once, before any worker starts"""
+    if not DATABASE_URL:
+        return False, ["⚠️  Skipped, DATABASE_URL not set"], False
+    import migrate_db
+    # Show migrate_db's own "Applying ..." / "Schema ..." lines in the report
+    lines = []
+    handler = logging.Handler(logging.INFO)
+    handler.emit = lambda record: lines.append(record.getMessage())
+    migrate_db.logger.addHandler(handler)
+    migrate_db.logger.setLevel(logging.INFO)
+    migrate_db.logger.propagate = False
+    try:
+        migrate_db.run_migrations(DATABASE_URL)
+    except Exception as e:
+        return False, lines + [f"⚠️  Migration step failed: {e}"], False
+    finally:
+        migrate_db.logger.removeHandler(handler)
+    return True, lines, False
+
+
+# (name, title, function, cacheable per build)
+CHECKS = [
+    ("browser", "🌐 Browser Check", check_browser, True),
+    ("dependencies", "🐍 Python Check", check_dependencies, True),
+    ("chrome", "🧪 Chrome Test", check_chrome, True),
+    ("database", "🗄️  Database Check", check_database, False),
+    ("migrations", "🔧 Schema Migrations", check_migrations, False),
+]
+
+
+def timed(check):
+    started = time.perf_counter()
+    ok, lines, fatal = check()
+    return {"ok": ok, "lines": lines, "fatal": fatal, "seconds": round(time.perf_counter() - started, 2)}
+
+
+def run_preflight():
+    """Run every check in parallel; returns False when a fatal check failed"""
+    started = time.perf_counter()
+    build = build_id()
+    cached = load_cache(build)
+
+    with ThreadPoolExecutor(max_workers=len(CHECKS)) as executor:
+        futures = {
+            name: executor.submit(timed, check)
+            for name, _, check, cacheable in CHECKS
+            if not (cacheable and cached.get(name, {}).get("ok"))
+        }
+        results = {name: future.result() for name, future in futures.items()}
+
+    fatal = False
+    for name, title, _, cacheable in CHECKS:
+        result = results.get(name) or dict(cached[name], seconds=0.0)
+        source = "cached" if name not in results else f"{result['seconds']:.2f}s"
+        print(f"{title} ({source}):")
+        for line in result["lines"]:
+            print(f"   {line}")
+        fatal = fatal or (not result["ok"] and result.get("fatal", False))
+        if cacheable and result["ok"]:
+            cached[name] = {"ok": True, "lines": result["lines"], "fatal": False}
+
+    save_cache(build, {name: value for name, value in cached.items() if value.get("ok")})
+    print(f"⏱️  Preflight: {time.perf_counter() - started:.2f}s")
+    return not fatal
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    print("🔍 Environment Check:")
+    print(f"   INSTAGRAM_USERNAME: {'SET' if os.getenv('INSTAGRAM_USERNAME') else ''}")
+    print(f"   DATABASE_URL: {'SET' if DATABASE_URL else ''}")
+    print(f"   Python: {sys.version.split()[0]}")
+    if not run_preflight():
+        exit(1)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Parallel, resumable HTTP downloads for large media files
+Splits a file into byte ranges fetched over several connections, retries
+each range from where it stopped, remembers progress on disk so a later
+attempt resumes instead of starting over, and verifies the final length.
+"""
+
+import os
+import json
+import math
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+RANGED_CONNECTIONS = int(os.getenv("RANGED_CONNECTIONS", 4))
+RANGED_RETRIES = int(os.getenv("RANGED_RETRIES", 3))
+# Files smaller than this are fetched over a single (still resumable) connection
+RANGED_MIN_SIZE = int(os.getenv("RANGED_MIN_SIZE", 4 * 1024 * 1024))
+# Progress is written to disk every N chunks per part, so a killed process can resume
+RANGED_SAVE_EVERY = int(os.getenv("RANGED_SAVE_EVERY", 16))
+MIN_PART_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+
+def chunk_size_for(total_size):
+    """Read buffer that grows with the file: 64 KB for small files up to 1 MB"""
+    return min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, total_size // 256))
+
+
+def plan_parts(total_size, connections):
+    """Split [0, total_size) into inclusive (start, end) byte ranges"""
+    part_size = max(MIN_PART_SIZE, math.ceil(total_size / max(1, connections)))
+    return [(start, min(start + part_size, total_size) - 1) for start in range(0, total_size, part_size)]
+
+
+def probe(url, headers=None, timeout=10):
+    """HEAD the URL; returns (size, accepts_ranges, content_type)"""
+    response = requests.head(url, headers=headers, allow_redirects=True, timeout=timeout)
+    response.raise_for_status()
+    size = int(response.headers.get('content-length', 0))
+    accepts_ranges = response.headers.get('accept-ranges', '').lower() == 'bytes'
+    return size, accepts_ranges, response.headers.get('content-type', '').lower()
+
+
+class _Progress:
+    """Bytes written per part, persisted next to the partial file"""
+
+    def __init__(self, path, url, size, parts):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.parts = parts
+        self.done = [0] * len(parts)
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            if saved["url"] == self.url and saved["size"] == self.size and \
+                    [tuple(p) for p in saved["parts"]] == self.parts:
+                self.done = saved["done"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return sum(self.done)
+
+    def update(self, index, written):
+        with self._lock:
+            self.done[index] = written
+
+    def save(self):
+        # Parts save concurrently; the lock keeps them off each other's tmp file
+        with self._lock:
+            state = {"url": self.url, "size": self.size, "parts": self.parts, "done": self.done}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def _fetch_part(url, headers, dest_path, index, start, end, progress, chunk_size):
+    """Fetch one byte range, resuming from the last written byte on errors"""
+    written = progress.done[index]
+    attempt = 0
+    chunks = 0
+    while start + written <= end:
+        try:
+            range_headers = dict(headers or {}, Range=f"bytes={start + written}-{end}")
+            with requests.get(url, headers=range_headers, stream=True, timeout=30) as response:
+                if response.status_code != 206:
+                    raise IOError(f"range request answered with HTTP {response.status_code}")
+                with open(dest_path, 'r+b') as f:
+                    f.seek(start + written)
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if not chunk:
+                            continue
+                        chunk = chunk[:end - (start + written) + 1]
+                        f.write(chunk)
+                        written += len(chunk)
+                        progress.update(index, written)
+                        chunks += 1
+                        if chunks % RANGED_SAVE_EVERY == 0:
+                            # Bytes must be on disk before the progress file claims them
+                            f.flush()
+                            progress.save()
+            if start + written <= end:
+                raise IOError("connection closed before the range was complete")
+        except Exception as e:
+            attempt += 1
+            if attempt > RANGED_RETRIES:
+                raise
+            logger.warning(f"⚠️ Part {index} failed at byte {start + written} ({e}), retry {attempt}/{RANGED_RETRIES}")
+            time.sleep(min(2 ** attempt, 10))
+    return written
+
+
+def _download_single(url, headers, dest_path, chunk_size):
+    """Plain streaming download for servers without range support"""
+    with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        with open(dest_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+        return response.headers.get('content-type', '').lower()
+
+
+def download_file(url, dest_path, headers=None, expected_size=None, connections=RANGED_CONNECTIONS):
+    """Download `url` to `dest_path`; returns the content type, or None on failure
+
+    `expected_size` (e.g. memes.file_size from the fetch-time HEAD) is only a
+    fallback: the live Content-Length is authoritative and the finished file
+    must measure that. A partial `dest_path` left by an earlier failed call is
+    resumed (a changed size restarts it).
+    """
+    progress_path = f"{dest_path}.progress"
+    try:
+        size, accepts_ranges, content_type = probe(url, headers)
+
+        if expected_size and size and size != expected_size:
+            logger.warning(f"⚠️ Size changed since fetch: expected {expected_size:,}, server reports {size:,}")
+        size = size or expected_size or 0
+
+        if not size or not accepts_ranges:
+            content_type = _download_single(url, headers, dest_path, chunk_size_for(size)) or content_type
+            if size and os.path.getsize(dest_path) != size:
+                logger.error(f"❌ Incomplete download: {os.path.getsize(dest_path):,} of {size:,} bytes")
+                return None
+            return content_type
+
+        if size < RANGED_MIN_SIZE:
+            connections = 1
+        parts = plan_parts(size, connections)
+        progress = _Progress(progress_path, url, size, parts)
+        resumed = progress.load() if os.path.exists(dest_path) else 0
+        if resumed:
+            logger.info(f"⏯️ Resuming download at {resumed:,}/{size:,} bytes")
+
+        # Preallocate so every part can write at its own offset
+        with open(dest_path, 'ab') as f:
+            f.truncate(size)
+
+        chunk_size = chunk_size_for(size)
+        started = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix="ranged") as executor:
+                futures = [
+                    executor.submit(_fetch_part, url, headers, dest_path, index, start, end, progress, chunk_size)
+                    for index, (start, end) in enumerate(parts)
+                ]
+                for future in futures:
+                    future.result()
+        except Exception:
+            progress.save()
+            raise
+
+        if sum(progress.done) != size or os.path.getsize(dest_path) != size:
+            progress.save()
+            logger.error(f"❌ Length check failed: {sum(progress.done):,} of {size:,} bytes")
+            return None
+
+        progress.clear()
+        elapsed = max(time.time() - started, 0.001)
+        logger.info(f"✅ Ranged download: {size:,} bytes over {len(parts)} connection(s) "
+                    f"in {elapsed:.1f}s ({(size - resumed) / elapsed / 1024 / 1024:.1f} MB/s)")
+        return content_type
+
+    except Exception as e:
+        logger.error(f"❌ Ranged download failed: {e}")
+        return None
@@ -1,68 +1,297 @@
-# Add these imports at the top
+import os
+import time
+# Taken before the other imports; start.sh exports BOT_START_TIME so preflight counts too
+STARTUP_T0 = float(os.environ.get("BOT_START_TIME") or time.time())
 import threading
-from meme_graphql import app as graphql_app
-import uvicorn
+import asyncio
 import schedule
-import time
-import subprocess
 import sys
-import os
-import threading
 import json
-import glob
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import html
+import logging
+from collections import deque
 from datetime import datetime
+from cloud_meme_fetcher import fetch_memes, get_meme_stats
+import job_runner
+import media_cache
 
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
 
-# Add this function after your existing functions
-def start_graphql_server():
-    """Start GraphQL server alongside existing dashboard"""
-    graphql_port = int(os.environ.get("GRAPHQL_PORT", 8080))
-    logger.info(f"🚀 Starting GraphQL server on port {graphql_port}")
-    uvicorn.run(graphql_app, host="0.0.0.0", port=graphql_port)
-
-# In your main() function, add this after starting the health server:
-def main():
-    # Your existing code...
-    
-    # Start health server (keep this)
-    health_thread = threading.Thread(target=start_health_server, daemon=True)
-    health_thread.start()
-    
-    # NEW: Start GraphQL server
-    graphql_thread = threading.Thread(target=start_graphql_server, daemon=True)
-    graphql_thread.start()
-    
-    # Rest of your existing code...
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+PORT = int(os.environ.get("PORT", 10000))
+FETCH_INTERVAL_HOURS = int(os.environ.get("FETCH_INTERVAL_HOURS", 6))
+UPLOAD_INTERVAL_HOURS = int(os.environ.get("UPLOAD_INTERVAL_HOURS", 3))
+FETCH_TIMEOUT_SECONDS = float(os.environ.get("FETCH_TIMEOUT_SECONDS", 600))
+UPLOAD_TIMEOUT_SECONDS = float(os.environ.get("UPLOAD_TIMEOUT_SECONDS", 900))
+DEBUG_TIMEOUT_SECONDS = float(os.environ.get("DEBUG_TIMEOUT_SECONDS", 300))
+# /status and the dashboard serve a snapshot rebuilt this often (and after every job)
+STATUS_REFRESH_SECONDS = float(os.environ.get("STATUS_REFRESH_SECONDS", 15))
+STATUS_LOG_LINES = int(os.environ.get("STATUS_LOG_LINES", 200))
+STATUS_ERROR_LINES = int(os.environ.get("STATUS_ERROR_LINES", 50))
 
 # Global status variables
 bot_status = {
 "last_fetch": "Never",
-"last_upload": "Never", 
+"last_upload": "Never",
 "total_images": 0,
 "total_videos": 0,
 "posted_count": 0,
 "available_count": 0,
-"errors": [],
+"errors": deque(maxlen=STATUS_ERROR_LINES),
 "environment_check": {},
-"recent_logs": []
+"recent_logs": deque(maxlen=STATUS_LOG_LINES),
+"startup": {},
+"claims": {},
+"media_cache": {}
 }
 
+# Pre-serialised /status body and dashboard page, swapped in whole by publish_status()
+status_snapshot = {"json": "{}", "html": ""}
+
+def mark_startup(phase):
+    """Record how long after process start a startup phase finished"""
+    bot_status["startup"][phase] = round(time.time() - STARTUP_T0, 3)
+
+def startup_report():
+    """Log the startup phases like `python -X importtime`: self and cumulative seconds"""
+    log_message(f"🩺 Healthy {bot_status['startup']['healthy']:.2f}s after start")
+    logger.info("startup time: self [s] | cumulative | phase")
+    previous = 0.0
+    for phase, cumulative in sorted(list(bot_status["startup"].items()), key=lambda item: item[1]):
+        logger.info(f"startup time: {cumulative - previous:8.3f} | {cumulative:10.3f} | {phase}")
+        previous = cumulative
+
+def log_message(*parts):
+    """Log message with timestamp"""
+    message = " ".join(str(part) for part in parts)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    logger.info(message)
+    bot_status["recent_logs"].append(f"[{timestamp}] {message}")
+
+def log_error(message):
+    """Record an error for the dashboard"""
+    log_message(message)
+    bot_status["errors"].append({
+        "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "message": message
+    })
+
+def check_environment():
+    """Record which required settings are present"""
+    required = ["DATABASE_URL", "INSTAGRAM_USERNAME", "INSTAGRAM_PASSWORD",
+                "REDDIT_CLIENT_ID", "REDDIT_CLIENT_SECRET"]
+    bot_status["environment_check"] = {name: bool(os.environ.get(name)) for name in required}
+    missing = [name for name, present in bot_status["environment_check"].items() if not present]
+    if missing:
+        log_error(f"⚠️ Missing environment variables: {', '.join(missing)}")
+    else:
+        log_message("✅ All environment variables set")
+
+def update_stats():
+    """Refresh dashboard counts from the database"""
+    stats = get_meme_stats()
+    if stats:
+        bot_status["total_images"] = stats.get("total_images") or 0
+        bot_status["total_videos"] = stats.get("total_videos") or 0
+        bot_status["posted_count"] = stats.get("posted") or 0
+        bot_status["available_count"] = stats.get("available") or 0
+    # Claim counters live in the uploader, which is only imported by the first upload
+    uploader = sys.modules.get("cloud_instagram_uploader")
+    if uploader:
+        bot_status["claims"] = uploader.get_claim_stats()
+    # Opening the cache scans its directory, so this stays off the event loop
+    bot_status["media_cache"] = media_cache.get_cache().stats()
+
+def fetch_job():
+    """Fetch new memes into the database"""
+    result = fetch_memes()
+    if result.get("error"):
+        return False, f"Fetch failed: {result['error']}"
+    return True, (f"Fetch completed: {result['images_fetched']} images, "
+                  f"{result['videos_fetched']} videos added")
+
+def upload_job():
+    """Queue an upload on the resident uploader worker and wait for it"""
+    # Selenium and the worker thread load on the first upload, not at startup
+    import uploader_worker
+    job = uploader_worker.enqueue_upload()
+    if not job.wait(UPLOAD_TIMEOUT_SECONDS):
+        return False, f"Upload job {job.id} still running after {UPLOAD_TIMEOUT_SECONDS:.0f}s"
+    return job.success, job.message
+
+def job_finished(job, run):
+    """Record a finished job run on the dashboard"""
+    if run["success"]:
+        if job.name in ("fetch", "upload"):
+            bot_status[f"last_{job.name}"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        log_message(f"✅ {job.name} ({run['duration']:.1f}s): {run['message']}")
+    else:
+        log_error(f"❌ {job.name} failed ({run['duration']:.1f}s): {run['message']}")
+    if job.name in ("fetch", "upload"):
+        update_stats()
+    publish_status()
+
+runner = job_runner.get_runner()
+runner.on_finish.append(job_finished)
+runner.register("fetch", fetch_job, FETCH_TIMEOUT_SECONDS,
+                command=[sys.executable, "cloud_meme_fetcher.py"])
+runner.register("upload", upload_job, UPLOAD_TIMEOUT_SECONDS,
+                command=[sys.executable, "uploader_worker.py"])
+# The standalone uploader drives its own Chrome, so it always runs isolated
+runner.register("debug", None, DEBUG_TIMEOUT_SECONDS,
+                command=[sys.executable, "cloud_instagram_uploader.py"], jitter=0, isolate=True)
+
+def run_fetch():
+    """Start a fetch unless one is already running"""
+    log_message("📥 Running meme fetch...")
+    runner.trigger("fetch")
+
+def run_upload():
+    """Start an upload unless one is already running"""
+    log_message("📤 Running Instagram upload...")
+    runner.trigger("upload")
+
 def run_debug_check():
     """Run comprehensive debug check"""
     log_message("🔍 Running debug diagnostics...")
-    try:
-        result = subprocess.run([sys.executable, "cloud_instagram_uploader.py"], 
-                              capture_output=True, text=True, timeout=300)
-        
-        # Log all output for debugging
-        log_message("STDOUT:", result.stdout)
-        log_message("STDERR:", result.stderr)
-        log_message(f"Return code: {result.returncode}")
-        
-    except Exception as e:
-        log_message(f"❌ Debug check failed: {e}")
-
-def log_message(message):
-"""Log message with timestamp"""
-timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    runner.trigger("debug", jitter=False)
+
+def render_dashboard(status):
+    """Simple HTML status page (everything shown is escaped: logs carry Reddit titles)"""
+    logs = "\n".join(html.escape(line) for line in status["recent_logs"][-50:])
+    errors = "\n".join(html.escape(f"[{e['time']}] {e['message']}") for e in status["errors"][-20:])
+    jobs = "\n".join(
+        html.escape(f"{name}: {'running' if job['running'] else 'idle'} | runs {job['runs']} | "
+                    f"avg {job['avg_duration']:.1f}s | max {job['max_duration']:.1f}s | skipped {job['skipped']}")
+        for name, job in status["jobs"].items()
+    )
+    claims = status["claims"]
+    if claims:
+        jobs += "\n" + html.escape(
+            f"queue claims: {claims['claims']} | claimed {claims['claimed']} | reclaimed {claims['reclaimed']} | "
+            f"avg {claims['avg_ms']:.1f} ms | max {claims['max_ms']:.1f} ms"
+        )
+    cache = status["media_cache"]
+    if cache:
+        jobs += "\n" + html.escape(
+            f"media cache: hits {cache['hits']} | misses {cache['misses']} | hit rate {cache['hit_rate']:.0%} | "
+            f"evictions {cache['evictions']} | {cache['total_bytes'] / 1024 / 1024:.0f} of "
+            f"{cache['max_bytes'] / 1024 / 1024:.0f} MB"
+        )
+    return f"""<html>
+<head><title>Instagram Meme Bot</title><meta http-equiv="refresh" content="30"></head>
+<body style="font-family: monospace;">
+<h1>🤖 Instagram Meme Bot</h1>
+<p>Last fetch: {html.escape(str(status['last_fetch']))}<br>
+Last upload: {html.escape(str(status['last_upload']))}<br>
+Images: {html.escape(str(status['total_images']))} | Videos: {html.escape(str(status['total_videos']))}<br>
+Posted: {html.escape(str(status['posted_count']))} | Available: {html.escape(str(status['available_count']))}<br>
+Updated: {html.escape(str(status['snapshot_at']))}</p>
+<h2>Jobs</h2><pre>{jobs}</pre>
+<h2>Recent logs</h2><pre>{logs}</pre>
+<h2>Errors</h2><pre>{errors}</pre>
+</body>
+</html>"""
+
+def publish_status():
+    """Rebuild the /status body and dashboard page that requests are served from"""
+    status = dict(
+        bot_status,
+        recent_logs=list(bot_status["recent_logs"]),
+        errors=list(bot_status["errors"]),
+        startup=dict(bot_status["startup"]),
+        claims=dict(bot_status["claims"]),
+        media_cache=dict(bot_status["media_cache"]),
+        jobs=runner.stats(),
+        snapshot_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    )
+    status_snapshot["json"] = json.dumps(status, default=str)
+    status_snapshot["html"] = render_dashboard(status)
+
+async def refresh_status_forever():
+    """Keep the snapshot fresh without doing database work inside requests"""
+    while True:
+        try:
+            await asyncio.to_thread(update_stats)
+            publish_status()
+        except Exception as e:
+            logger.error(f"❌ Status refresh failed: {e}")
+        await asyncio.sleep(STATUS_REFRESH_SECONDS)
+
+def build_app():
+    """Health, status, dashboard and GraphQL on one async server"""
+    # strawberry/FastAPI are the heaviest imports; load them here, not at module import
+    from fastapi import FastAPI
+    from fastapi.responses import HTMLResponse, Response
+    import meme_graphql
+    mark_startup("server imports")
+
+    app = FastAPI(title="Instagram Meme Bot")
+    background_tasks = []
+
+    @app.on_event("startup")
+    async def startup():
+        # Mounted apps don't get lifespan events, so run the GraphQL API's ourselves
+        await meme_graphql.app.router.startup()
+        publish_status()
+        background_tasks.append(asyncio.create_task(refresh_status_forever()))
+        mark_startup("healthy")
+        startup_report()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        for task in background_tasks:
+            task.cancel()
+        await meme_graphql.app.router.shutdown()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    @app.get("/status")
+    async def status():
+        return Response(status_snapshot["json"], media_type="application/json")
+
+    @app.get("/", response_class=HTMLResponse)
+    async def dashboard():
+        return HTMLResponse(status_snapshot["html"])
+
+    # Everything else, i.e. /graphql, is the GraphQL API
+    app.mount("/", meme_graphql.app)
+    return app
+
+def start_server():
+    """Serve health checks, the dashboard and GraphQL on PORT"""
+    import uvicorn
+    app = build_app()
+    logger.info(f"🌐 Health, dashboard and GraphQL on port {PORT}")
+    uvicorn.run(app, host="0.0.0.0", port=PORT)
+
+def main():
+    mark_startup("imports")
+    log_message("🚀 Instagram Meme Bot scheduler starting...")
+    check_environment()
+
+    # Start health, dashboard and GraphQL server
+    server_thread = threading.Thread(target=start_server, daemon=True)
+    server_thread.start()
+
+    schedule.every(FETCH_INTERVAL_HOURS).hours.do(run_fetch)
+    schedule.every(UPLOAD_INTERVAL_HOURS).hours.do(run_upload)
+
+    update_stats()
+    log_message("📥 Running meme fetch...")
+    runner.trigger("fetch", jitter=False)
+
+    while True:
+        schedule.run_pending()
+        time.sleep(60)
+
+if __name__ == "__main__":
+    main()
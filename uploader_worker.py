@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Resident Instagram uploader
+Keeps one warm, logged-in Chrome driver and works through upload jobs
+from a queue, so callers enqueue work instead of forking the uploader.
+"""
+
+import os
+import queue
+import threading
+import time
+import uuid
+import logging
+from datetime import datetime
+import cloud_instagram_uploader as uploader
+
+logger = logging.getLogger(__name__)
+
+# ====== CONFIG FROM ENVIRONMENT VARIABLES ======
+# Start a fresh Chrome after this many jobs to keep memory in check
+UPLOADER_RECYCLE_AFTER = int(os.getenv("UPLOADER_RECYCLE_AFTER", 20))
+# Close the driver when no job arrives for this long (seconds)
+UPLOADER_IDLE_TIMEOUT = float(os.getenv("UPLOADER_IDLE_TIMEOUT", 1800))
+
+
+class UploadJob:
+    """One queued upload request"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.success = None
+        self.message = "Queued"
+        self._done = threading.Event()
+
+    def finish(self, success, message):
+        self.success = success
+        self.message = message
+        self.finished_at = datetime.now()
+        self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns False on timeout"""
+        return self._done.wait(timeout)
+
+
+class UploaderWorker(threading.Thread):
+    """Background thread that owns the Chrome driver and runs uploads in order"""
+
+    def __init__(self, recycle_after=UPLOADER_RECYCLE_AFTER, idle_timeout=UPLOADER_IDLE_TIMEOUT):
+        super().__init__(name="uploader-worker", daemon=True)
+        self.recycle_after = recycle_after
+        self.idle_timeout = idle_timeout
+        self.jobs = queue.Queue()
+        self.driver = None
+        self.jobs_on_driver = 0
+        self.drivers_started = 0
+        self.jobs_processed = 0
+        self._stopping = threading.Event()
+
+    def submit(self):
+        """Queue an upload of the next best meme"""
+        job = UploadJob()
+        self.jobs.put(job)
+        logger.info(f"📥 Upload job {job.id} queued ({self.jobs.qsize()} waiting)")
+        return job
+
+    def stop(self):
+        self._stopping.set()
+        self.jobs.put(None)
+
+    def run(self):
+        logger.info("🧵 Uploader worker started")
+        while not self._stopping.is_set():
+            try:
+                job = self.jobs.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                if self.driver:
+                    logger.info("💤 Uploader idle, closing Chrome")
+                    self._recycle_driver()
+                continue
+
+            if job is None:
+                break
+
+            self.jobs_processed += 1
+            try:
+                self._process(job)
+            except Exception as e:
+                logger.error(f"❌ Upload job {job.id} crashed: {e}")
+                self._recycle_driver()
+                job.finish(False, f"Error: {e}")
+
+        self._recycle_driver()
+        logger.info("🧵 Uploader worker stopped")
+
+    def _ensure_driver(self):
+        """Start and log in a driver unless a warm one is available"""
+        if self.driver:
+            return True
+
+        driver = uploader.setup_driver()
+        if not driver:
+            return False
+
+        if not uploader.ensure_logged_in(driver, uploader.INSTAGRAM_USERNAME, uploader.INSTAGRAM_PASSWORD):
+            driver.quit()
+            return False
+
+        self.driver = driver
+        self.jobs_on_driver = 0
+        self.drivers_started += 1
+        return True
+
+    def _recycle_driver(self):
+        if not self.driver:
+            return
+        try:
+            self.driver.quit()
+            logger.info("🔒 Driver closed")
+        except Exception:
+            pass
+        self.driver = None
+        self.jobs_on_driver = 0
+
+    def _process(self, job):
+        job.started_at = datetime.now()
+        job.message = "Running"
+        started = time.time()
+        logger.info(f"🚀 Upload job {job.id} started")
+
+        if not uploader.check_prerequisites():
+            job.finish(False, "Prerequisite check failed")
+            return
+
+        # Downloads overlap with (re)starting Chrome when the driver is cold
+        prefetch = uploader.start_prefetch()
+        if not prefetch:
+            job.finish(False, "No meme available to upload")
+            return
+
+        try:
+            if not self._ensure_driver():
+                job.finish(False, "Chrome setup or login failed")
+                return
+
+            meme, temp_file = prefetch.next_ready()
+            if not meme:
+                job.finish(False, "No queued meme could be downloaded")
+                return
+
+            success = uploader.publish_meme(self.driver, meme, temp_file)
+            self.jobs_on_driver += 1
+        finally:
+            prefetch.close()
+
+        # A failed upload may leave the page in an unknown state
+        if not success or self.jobs_on_driver >= self.recycle_after:
+            self._recycle_driver()
+
+        elapsed = time.time() - started
+        if success:
+            job.finish(True, f"Uploaded meme {meme['id']} in {elapsed:.0f}s")
+        else:
+            job.finish(False, f"Upload of meme {meme['id']} failed after {elapsed:.0f}s")
+        logger.info(f"🏁 Upload job {job.id}: {job.message}")
+
+    def stats(self):
+        return {
+            "queued": self.jobs.qsize(),
+            "jobs_processed": self.jobs_processed,
+            "drivers_started": self.drivers_started,
+            "driver_warm": self.driver is not None,
+            "jobs_on_driver": self.jobs_on_driver,
+            "claims": uploader.get_claim_stats(),
+        }
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    """Get the process-wide uploader worker, starting it on first use"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = UploaderWorker()
+            _worker.start()
+    return _worker
+
+
+def enqueue_upload():
+    """Queue an upload of the next best meme and return its job"""
+    return get_worker().submit()
+
+
+if __name__ == "__main__":
+    job = enqueue_upload()
+    job.wait()
+    print(("✅ " if job.success else "❌ ") + job.message)
+    exit(0 if job.success else 1)